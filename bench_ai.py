@@ -0,0 +1,63 @@
+# Benchmark: cost of one AI think (feature building + one batched policy call +
+# writing orders back) at increasing army sizes. Fails if any size goes over budget.
+#
+#   python bench_ai.py [--budget-ms 10] [--backend numpy|tensorflow]
+import os
+import argparse
+import random
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import main
+
+ARMY_SIZES = [20, 100, 500, 1000, 2000]
+
+
+def fill_army(owner, n, zone):
+    units = main.player_units if owner == 'player' else main.enemy_units
+    units.clear()
+    for _ in range(n):
+        u_type = "tank" if random.random() < 0.3 else "troop"
+        units.append(main.create_unit(random.uniform(zone.left, zone.right), random.uniform(zone.top, zone.bottom), u_type))
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Per-think AI policy cost at large army sizes")
+    parser.add_argument("--budget-ms", type=float, default=10.0, help="per-think budget; a 60 FPS frame is 16.7 ms")
+    parser.add_argument("--backend", default=main.AI_POLICY_BACKEND, choices=["numpy", "tensorflow"])
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    main.AI_POLICY_BACKEND = args.backend
+    main.TELEMETRY_ENABLED = False
+    random.seed(0)
+    main.init_game("crossroads", "single")
+    t0 = time.perf_counter()
+    if main.load_policy() is None:
+        print(f"no weights at {main.POLICY_PATH}; run train_policy.py first")
+        return 1
+    print(f"backend {args.backend}, model load {1000 * (time.perf_counter() - t0):.1f} ms (cached afterwards)")
+
+    failed = False
+    for n in ARMY_SIZES:
+        fill_army('ai', n, main.enemy_spawn_zone)
+        fill_army('player', n, main.player_spawn_zone)
+        main.run_tensorflow_movement()  # warm-up
+        times = []
+        for _ in range(args.repeats):
+            t0 = time.perf_counter()
+            main.run_tensorflow_movement()
+            times.append(1000 * (time.perf_counter() - t0))
+        times.sort()
+        median = times[len(times) // 2]
+        ok = median <= args.budget_ms
+        failed |= not ok
+        print(f"{n:6d} units per side: median {median:7.2f} ms/think  p90 {times[int(len(times) * 0.9)]:7.2f} ms"
+              f"  {'ok' if ok else 'OVER BUDGET'}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main_cli())
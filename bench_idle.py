@@ -0,0 +1,54 @@
+# Benchmark: CPU used while the game sits untouched on a menu screen.
+# Runs main() in a child process for each menu state, with and without IDLE_MENUS,
+# and reports process CPU time as a share of one core. SDL's dummy video driver
+# can't truly block in event.wait, so headless idle numbers are an upper bound.
+#
+#   python bench_idle.py [--seconds 5]
+import os
+import sys
+import argparse
+import subprocess
+import threading
+import time
+
+MENU_STATES = ["home", "map_select", "tutorial", "end"]
+
+
+def child(state, idle, seconds):
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    import main
+    main.IDLE_MENUS = idle
+    main.state = state
+    main.audio.loaded.wait(10)  # keep startup decoding out of the measurement
+    threading.Timer(seconds, lambda: main.pygame.event.post(main.pygame.event.Event(main.pygame.QUIT))).start()
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        main.main()
+    except SystemExit:
+        pass
+    print(f"{time.process_time() - cpu} {time.perf_counter() - wall}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Idle CPU usage on menu screens")
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--child", nargs=2, metavar=("STATE", "IDLE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.child[0], args.child[1] == "1", args.seconds)
+        return
+
+    print(f"{'screen':<12}{'polling 60 FPS':>16}{'idle menus':>14}")
+    for state in MENU_STATES:
+        usage = []
+        for idle in ("0", "1"):
+            out = subprocess.run([sys.executable, __file__, "--seconds", str(args.seconds), "--child", state, idle],
+                                 capture_output=True, text=True, check=True).stdout.split()
+            cpu, wall = float(out[-2]), float(out[-1])
+            usage.append(100 * cpu / wall)
+        print(f"{state:<12}{usage[0]:>15.1f}%{usage[1]:>13.1f}%")
+
+
+if __name__ == "__main__":
+    main_cli()
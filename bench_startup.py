@@ -0,0 +1,75 @@
+# Benchmark: cold start. Launches the game in a fresh interpreter several times and
+# reports time to import main.py, time to the first presented home frame, time until
+# the background loaders (fonts, sounds) are done, and peak RSS. Fails if the first
+# frame is over budget or if startup imported TensorFlow.
+#
+#   python bench_startup.py [--runs 5] [--budget-ms 1500]
+import os
+import sys
+import argparse
+import resource
+import subprocess
+import threading
+import time
+
+
+def child():
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    import main
+    stamps = {"import": time.time()}
+    present = main.present
+
+    def timed_present(rects=None):
+        present(rects)
+        stamps.setdefault("frame", time.time())
+
+    def wait_ready():
+        # assets_ready() turns true on the main loop, once it has swapped the fonts in
+        deadline = time.time() + 30
+        while not main.assets_ready() and time.time() < deadline:
+            time.sleep(0.005)
+        stamps["ready"] = time.time()
+        main.pygame.event.post(main.pygame.event.Event(main.pygame.QUIT))
+
+    main.present = timed_present
+    threading.Thread(target=wait_ready, daemon=True).start()
+    try:
+        main.main()
+    except SystemExit:
+        pass
+    print(stamps["import"], stamps.get("frame", 0.0), stamps["ready"], int("tensorflow" in sys.modules))
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Cold-start time and peak memory")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=1500.0)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child()
+        return
+
+    print(f"{'run':<5}{'import':>10}{'first frame':>14}{'assets ready':>15}{'peak RSS':>12}")
+    frames, failed = [], False
+    for run in range(args.runs):
+        start = time.time()
+        out = subprocess.run([sys.executable, __file__, "--child"], capture_output=True, text=True, check=True).stdout
+        imported, frame, ready, tf = out.split()[-4:]
+        ms = [1000 * (float(t) - start) for t in (imported, frame, ready)]
+        # Linux reports ru_maxrss in KB; the largest child so far, so it can only grow
+        rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+        frames.append(ms[1])
+        print(f"{run + 1:<5}{ms[0]:>8.0f}ms{ms[1]:>12.0f}ms{ms[2]:>13.0f}ms{rss:>9.0f} MB")
+        if tf == "1":
+            print("  TensorFlow was imported during startup")
+            failed = True
+    median = sorted(frames)[len(frames) // 2]
+    print(f"median first frame {median:.0f} ms (budget {args.budget_ms:.0f} ms)")
+    if failed or median > args.budget_ms:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,50 @@
+# Benchmark: throughput of the vectorized environment (VecWarOfDots) in env-steps
+# per second (one step = one game tick of one match) for increasing numbers of
+# parallel matches, against the single-match headless loop as a baseline. Both
+# sides are driven by the scripted heuristic, thinking and buying on the live timers.
+#
+#   python bench_vecenv.py [--map classic_bridge] [--ticks 600] [--envs 1 16 64 256 1024]
+import os
+import argparse
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import main
+
+
+def bench_vec(map_name, num_envs, ticks):
+    env = main.VecWarOfDots(map_name, num_envs, seed=0)
+    env.reset()
+    start = time.perf_counter()
+    for tick in range(ticks):
+        actions = env.scripted_actions(think=tick % main.AI_THINK_INTERVAL == 0, buy=tick % main.AI_BUY_INTERVAL == 0)
+        env.step(actions)
+    return num_envs * ticks / (time.perf_counter() - start)
+
+
+def bench_headless(map_name, ticks):
+    main.TELEMETRY_ENABLED = False
+    start = time.perf_counter()
+    played = main.run_headless_match(map_name, ticks)
+    return played / (time.perf_counter() - start)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Vectorized environment throughput")
+    parser.add_argument("--map", default="classic_bridge")
+    parser.add_argument("--ticks", type=int, default=600)
+    parser.add_argument("--envs", type=int, nargs="+", default=[1, 16, 64, 256, 1024])
+    args = parser.parse_args()
+
+    baseline = bench_headless(args.map, args.ticks)
+    print(f"map {args.map}, {args.ticks} ticks per env")
+    print(f"{'headless (1 match)':<22}{baseline:>12.0f} env-steps/s")
+    for n in args.envs:
+        rate = bench_vec(args.map, n, args.ticks)
+        print(f"{f'VecWarOfDots E={n}':<22}{rate:>12.0f} env-steps/s  {rate / baseline:>6.1f}x")
+
+
+if __name__ == "__main__":
+    main_cli()
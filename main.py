@@ -1,31 +1,33 @@
 import pygame
+import os
 import sys
 import random
 import math
+import heapq
+import threading
+import queue
+import json
+import time
+import tracemalloc
 import numpy as np
-import tensorflow as tf
 
-# Initialize Pygame
+# Initialize Pygame (mixer settings must be set before init)
+pygame.mixer.pre_init(44100, -16, 2, 512)
 pygame.init()
-pygame.mixer.init()
 # Get actual screen size
 info = pygame.display.Info()
-# We use your 800x600 logic, but scale it to the phone's actual pixels
-screen = pygame.display.set_mode((info.current_w, info.current_h), pygame.FULLSCREEN)
-WIDTH, HEIGHT = info.current_w, info.current_h
+NATIVE_W, NATIVE_H = info.current_w, info.current_h
 
 # Load the files from your folder
-# Initialize mixer first
-try:
-    pygame.mixer.pre_init(44100, -16, 2, 512)
-    pygame.mixer.init()
-except:
-    print("Mixer failed to start")
+if not pygame.mixer.get_init():
+    try:
+        pygame.mixer.init()
+    except pygame.error:
+        print("Mixer failed to start")
 
 def safe_load_sound(filename):
     try:
         # This will look for the file in the same folder as main.py
-        import os
         path = os.path.join(os.path.dirname(__file__), filename)
         if os.path.exists(path):
             return pygame.mixer.Sound(path)
@@ -36,11 +38,6 @@ def safe_load_sound(filename):
         print(f"Error loading {filename}: {e}")
         return None
 
-# Load the sounds
-sfx_explosion = safe_load_sound("explosion.wav")
-sfx_spawn = safe_load_sound("spawn.wav")
-sfx_tank = safe_load_sound("tank_fire.flac")
-
 # ----- Constants -----
 WIDTH, HEIGHT = 800, 600
 FPS = 60
@@ -66,15 +63,214 @@ LIGHT_GREY = (200, 200, 200)
 GOLD = (255, 215, 0)
 
 # Fonts
-FONT_LARGE = pygame.font.SysFont("Arial", 40, bold=True)
-FONT_MEDIUM = pygame.font.SysFont("Arial", 28)
-FONT_SMALL = pygame.font.SysFont("Arial", 16)
-FONT_TINY = pygame.font.SysFont("Arial", 12, bold=True)
+# SysFont has to scan the system font list (fontconfig on Linux), which can take a
+# while on a cold start. The first frames use pygame's built-in font and a loader
+# thread swaps the real ones in (see apply_loaded_fonts).
+FONT_SPECS = {
+    # global name: (size, bold)
+    "FONT_LARGE": (40, True),
+    "FONT_MEDIUM": (28, False),
+    "FONT_SMALL": (16, False),
+    "FONT_TINY": (12, True),
+}
+ASSETS_READY = pygame.event.custom_type()
+loaded_fonts = {}
+fonts_ready = threading.Event()
+fonts_applied = False
+
+
+def placeholder_font(size, bold):
+    font = pygame.font.Font(None, size)
+    font.set_bold(bold)
+    return font
+
+
+def load_fonts():
+    for name, (size, bold) in FONT_SPECS.items():
+        try:
+            loaded_fonts[name] = pygame.font.SysFont("Arial", size, bold=bold)
+        except Exception as e:
+            print(f"Error loading font Arial {size}: {e}")
+    fonts_ready.set()
+    # Wakes a menu blocked in event.wait so it redraws with the new fonts
+    pygame.event.post(pygame.event.Event(ASSETS_READY))
+
+
+def apply_loaded_fonts():
+    # Main thread only: swap the fonts in once, dropping text rendered with the placeholders
+    global fonts_applied, menu_drawn_state
+    if fonts_applied or not fonts_ready.is_set(): return
+    globals().update(loaded_fonts)
+    fonts_applied = True
+    hud_cache.clear()
+    menu_drawn_state = None
+
+
+def assets_ready():
+    # Real fonts swapped in and sounds decoded; the home screen shows "Loading..." until then
+    return fonts_applied and audio.loaded.is_set()
+
+
+FONT_LARGE, FONT_MEDIUM, FONT_SMALL, FONT_TINY = (placeholder_font(*spec) for spec in FONT_SPECS.values())
+threading.Thread(target=load_fonts, daemon=True).start()
+
+# ----- Display -----
+# Everything is drawn at the logical WIDTH x HEIGHT into `screen`, and present() puts
+# it on the real display with one scale per frame. The internal resolution itself is
+# not selectable: drawing, hit-testing and the game rules all use absolute 800x600
+# coordinates, so another canvas size would mean scaling every draw call. What can be
+# chosen is how the canvas reaches the display. RENDER_MODE trades quality for speed:
+#   "gpu"        - SDL's SCALED mode, the renderer stretches with nearest filtering
+#   "gpu_smooth" - same, with linear filtering
+#   "fast"       - software nearest-neighbour scale into the native-size window
+#   "smooth"     - software smoothscale, best quality, slowest
+# DOTS_RENDER_MODE in the environment picks it at launch (launchers, benchmarks), and
+# set_render_mode() switches at runtime (F2 in game cycles through them).
+RENDER_MODES = ("gpu", "gpu_smooth", "fast", "smooth")
+RENDER_MODE = os.environ.get("DOTS_RENDER_MODE", "gpu")
+if RENDER_MODE not in RENDER_MODES:
+    RENDER_MODE = "gpu"
+# python-for-android sets ANDROID_ARGUMENT; desktops get a logical-size window
+FULLSCREEN = "ANDROID_ARGUMENT" in os.environ
+
+
+def init_display():
+    global display, screen, present_rect, RENDER_MODE
+    flags = pygame.FULLSCREEN if FULLSCREEN else 0
+    if RENDER_MODE in ("gpu", "gpu_smooth"):
+        os.environ["SDL_RENDER_SCALE_QUALITY"] = "1" if RENDER_MODE == "gpu_smooth" else "0"
+        try:
+            display = screen = pygame.display.set_mode((WIDTH, HEIGHT), flags | pygame.SCALED)
+            present_rect = screen.get_rect()
+            return
+        except pygame.error as e:
+            print(f"SCALED display unavailable ({e}), using software scaling")
+            RENDER_MODE = "fast"
+    size = (NATIVE_W, NATIVE_H) if FULLSCREEN else (WIDTH, HEIGHT)
+    display = pygame.display.set_mode(size, flags)
+    display.fill(BLACK)
+    screen = pygame.Surface((WIDTH, HEIGHT)).convert()
+    # Largest rect with the logical aspect ratio, centered (letterboxed)
+    size = display.get_size()
+    scale = min(size[0] / WIDTH, size[1] / HEIGHT)
+    present_rect = pygame.Rect(0, 0, int(WIDTH * scale), int(HEIGHT * scale))
+    present_rect.center = (size[0] // 2, size[1] // 2)
+    pygame.display.flip()
+
+
+def set_render_mode(mode):
+    # Reopens the display; everything is redrawn into the new `screen` next frame
+    global RENDER_MODE, menu_drawn_state
+    RENDER_MODE = mode
+    init_display()
+    menu_drawn_state = None
+
+
+def present(rects=None):
+    if display is screen:
+        if rects is None:
+            pygame.display.flip()
+        else:
+            pygame.display.update(rects)
+        return
+    target = display.subsurface(present_rect)
+    if RENDER_MODE == "smooth":
+        pygame.transform.smoothscale(screen, present_rect.size, target)
+    else:
+        pygame.transform.scale(screen, present_rect.size, target)
+    pygame.display.update(present_rect)
+
 
-screen = pygame.display.set_mode((WIDTH, HEIGHT))
+def to_logical(pos):
+    # Window coordinates -> game coordinates (SCALED mode already reports logical ones)
+    if display is screen:
+        return pos
+    return ((pos[0] - present_rect.x) * WIDTH / present_rect.w,
+            (pos[1] - present_rect.y) * HEIGHT / present_rect.h)
+
+
+def logical_mouse_pos():
+    return to_logical(pygame.mouse.get_pos())
+
+
+init_display()
 pygame.display.set_caption("Dots of War - Fixed V7.1")
 clock = pygame.time.Clock()
 
+# ----- Audio -----
+# Each category owns a fixed pool of reserved mixer channels. play() only queues an
+# event; flush() runs once per frame, merges identical events and rate-limits each
+# category. The whole map is always on screen, so distance never drops a sound by
+# itself: it lowers the volume, and when more categories want a voice than a frame
+# allows, the lowest priority and then the farthest from the screen centre lose.
+SOUND_CATEGORIES = {
+    # name: (file, channels, min ms between plays, priority)
+    "explosion": ("explosion.wav", 3, 90, 2),
+    "spawn": ("spawn.wav", 2, 60, 1),
+    "tank": ("tank_fire.flac", 2, 120, 1),
+}
+AUDIO_MAX_VOICES_PER_FRAME = 2
+AUDIO_FALLOFF_DISTANCE = 500  # screen centre to corner; volume halves over it
+
+
+class AudioManager:
+    def __init__(self, categories):
+        self.categories = categories
+        self.sounds = {}
+        self.pools = {}
+        self.pending = {}
+        self.last_played = {}
+        self.loaded = threading.Event()
+
+    def start(self):
+        # Reserve channel pools and decode sounds on a background thread
+        if pygame.mixer.get_init():
+            total = sum(cfg[1] for cfg in self.categories.values())
+            pygame.mixer.set_num_channels(max(8, total))
+            pygame.mixer.set_reserved(total)
+            first = 0
+            for name, (_, channels, _, _) in self.categories.items():
+                self.pools[name] = [pygame.mixer.Channel(i) for i in range(first, first + channels)]
+                first += channels
+        threading.Thread(target=self._load_all, daemon=True).start()
+
+    def _load_all(self):
+        if pygame.mixer.get_init():
+            for name, (filename, _, _, _) in self.categories.items():
+                self.sounds[name] = safe_load_sound(filename)
+        self.loaded.set()
+        pygame.event.post(pygame.event.Event(ASSETS_READY))
+
+    def play(self, name, pos=None):
+        dist = 0.0
+        if pos is not None:
+            dist = min(AUDIO_FALLOFF_DISTANCE, math.hypot(pos[0] - WIDTH / 2, pos[1] - HEIGHT / 2))
+        count, nearest = self.pending.get(name, (0, dist))
+        self.pending[name] = (count + 1, min(nearest, dist))
+
+    def flush(self):
+        if not self.pending: return
+        now = pygame.time.get_ticks()
+        voices = 0
+        for name in sorted(self.pending, key=lambda n: (-self.categories[n][3], self.pending[n][1])):
+            count, dist = self.pending[name]
+            sound = self.sounds.get(name)  # not decoded yet -> dropped
+            if sound is None or voices >= AUDIO_MAX_VOICES_PER_FRAME: continue
+            if now - self.last_played.get(name, -10 ** 9) < self.categories[name][2]: continue
+            channel = next((c for c in self.pools.get(name, ()) if not c.get_busy()), None)
+            if channel is None: continue
+            # One voice per category per frame, a bit louder for bigger bursts, quieter far away
+            volume = min(1.0, 0.6 + 0.1 * (count - 1)) * (1.0 - 0.5 * dist / AUDIO_FALLOFF_DISTANCE)
+            channel.set_volume(volume)
+            channel.play(sound)
+            self.last_played[name] = now
+            voices += 1
+        self.pending.clear()
+
+
+audio = AudioManager(SOUND_CATEGORIES)
+audio.start()
+
 # ----- Game States -----
 STATE_HOME = "home"
 STATE_MAP_SELECT = "map_select"
@@ -119,6 +315,11 @@ TERRITORY_SCALE = 10
 TERRITORY_W = WIDTH // TERRITORY_SCALE
 TERRITORY_H = HEIGHT // TERRITORY_SCALE
 territory_surface = pygame.Surface((TERRITORY_W, TERRITORY_H))
+# Owner of every territory cell (index into TERRITORY_OWNERS); the surface mirrors it
+TERRITORY_OWNERS = ["none", "player", "ai"]
+TERRITORY_COLORS = {"player": MAP_PLAYER, "ai": MAP_AI}
+territory = np.zeros((TERRITORY_H, TERRITORY_W), dtype=np.int8)
+city_territory_cells = {}
 
 # Unit lists
 player_units = []
@@ -126,8 +327,8 @@ enemy_units = []
 cities = []
 mountains = []
 rivers = []
-floating_texts = []
 particles = []
+PARTICLE_CAP = 400
 screen_shake = 0
 
 MAX_UNITS = 20
@@ -138,6 +339,14 @@ selected_units = set()
 TROOP_SPEED = 2.5
 TANK_SPEED = 4.0
 
+# Unit rules
+UNIT_COST = {"troop": 350, "tank": 500}
+UNIT_HP = {"troop": 80, "tank": 150}
+UNIT_DAMAGE = {"troop": 5, "tank": 8}
+SEPARATION_RADIUS = 12
+COMBAT_RADIUS = 18
+HIT_CHANCE = 0.1
+
 # AI Logic Timers
 AI_THINK_INTERVAL = 20
 AI_BUY_INTERVAL = 45
@@ -145,12 +354,29 @@ ai_think_timer = 0
 ai_buy_timer = 0
 
 # TENSORFLOW CONSTANTS
+# Kept as NumPy so the game runs without importing TensorFlow (see get_tf)
 GRID_SIZE = 20
 GRID_W = WIDTH // GRID_SIZE
 GRID_H = HEIGHT // GRID_SIZE
-KERNEL = tf.reshape(tf.constant(
+KERNEL = np.reshape(np.array(
     [[0.05, 0.1, 0.1, 0.1, 0.05], [0.1, 0.2, 0.2, 0.2, 0.1], [0.1, 0.2, 1.0, 0.2, 0.1], [0.1, 0.2, 0.2, 0.2, 0.1],
-     [0.05, 0.1, 0.1, 0.1, 0.05]], dtype=tf.float32), [5, 5, 1, 1])
+     [0.05, 0.1, 0.1, 0.1, 0.05]], dtype=np.float32), [5, 5, 1, 1])
+
+# Policy network: "numpy" runs inference without TensorFlow, "tensorflow" imports it on first use
+AI_POLICY_BACKEND = "numpy"
+POLICY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "policy_weights.npz")
+AI_EXPLORE = 0.0
+ai_policy = None
+ai_decision_log = None
+_tf = None
+
+
+def get_tf():
+    global _tf
+    if _tf is None:
+        import tensorflow
+        _tf = tensorflow
+    return _tf
 
 
 class Particle:
@@ -169,22 +395,46 @@ class Particle:
         return self.life > 0
 
     def draw(self, surf):
-        p_surf = pygame.Surface((self.size, self.size))
+        # One shared square per size and color; only the alpha changes between particles
+        key = (self.size, self.color)
+        p_surf = particle_surfaces.get(key)
+        if p_surf is None:
+            p_surf = particle_surfaces[key] = pygame.Surface((self.size, self.size))
+            p_surf.fill(self.color)
         p_surf.set_alpha(self.life)
-        p_surf.fill(self.color)
         surf.blit(p_surf, (self.x, self.y))
 
 
+particle_surfaces = {}
+
+
+def update_particles():
+    particles[:] = [p for p in particles if p.update()]
+
+
 # ----- CLASS: Floating Text -----
+FLOATING_TEXT_DURATION = 60
+FLOATING_TEXT_CAP = 128
+DAMAGE_MERGE_WINDOW = 15  # frames a damage number keeps absorbing new hits on the same unit
+
+
 class FloatingText:
-    def __init__(self, x, y, text, color, duration=60):
+    __slots__ = ("x", "y", "text", "color", "duration", "timer", "alpha", "key", "amount", "surf")
+
+    def __init__(self):
+        self.reset(0, 0, "", WHITE)
+
+    def reset(self, x, y, text, color, key=None, amount=0):
         self.x = x
         self.y = y
         self.text = text
         self.color = color
-        self.duration = duration
+        self.duration = FLOATING_TEXT_DURATION
         self.timer = 0
         self.alpha = 255
+        self.key = key
+        self.amount = amount
+        self.surf = None
 
     def update(self):
         self.y -= 0.5
@@ -193,26 +443,96 @@ class FloatingText:
             self.alpha = max(0, 255 - int(255 * (self.timer - self.duration * 0.7) / (self.duration * 0.3)))
 
     def draw(self, surf):
-        txt_surf = FONT_TINY.render(self.text, True, self.color)
-        txt_surf.set_alpha(self.alpha)
-        surf.blit(txt_surf, (self.x - txt_surf.get_width() // 2, self.y))
+        # Rendered once per text change instead of every frame
+        if self.surf is None:
+            self.surf = FONT_TINY.render(self.text, True, self.color)
+        self.surf.set_alpha(self.alpha)
+        surf.blit(self.surf, (self.x - self.surf.get_width() // 2, self.y))
+
+
+class FloatingTextPool:
+    # Preallocated ring buffer. Every text lives the same number of frames, so the
+    # oldest one is always at the tail: expiry and oldest-first eviction are O(1).
+    def __init__(self, capacity):
+        self.slots = [FloatingText() for _ in range(capacity)]
+        self.head = 0
+        self.count = 0
+        self.merging = {}
+
+    def _tail(self):
+        return self.slots[(self.head - self.count) % len(self.slots)]
+
+    def _drop_tail(self):
+        ft = self._tail()
+        if self.merging.get(ft.key) is ft:
+            del self.merging[ft.key]
+        self.count -= 1
+
+    def spawn(self, x, y, text, color, key=None, amount=0):
+        if self.count == len(self.slots):
+            self._drop_tail()
+        ft = self.slots[self.head]
+        ft.reset(x, y, text, color, key, amount)
+        self.head = (self.head + 1) % len(self.slots)
+        self.count += 1
+        if key is not None:
+            self.merging[key] = ft
+        return ft
+
+    def add_damage(self, key, x, y, amount, color):
+        # Hits on the same unit within the merge window add up into one number
+        ft = self.merging.get(key)
+        if ft is not None and ft.timer <= DAMAGE_MERGE_WINDOW:
+            ft.amount += amount
+            ft.text = f"-{ft.amount}"
+            ft.x = x
+            ft.surf = None
+        else:
+            self.spawn(x, y, f"-{amount}", color, key, amount)
+
+    def update(self):
+        for ft in self:
+            ft.update()
+        while self.count and self._tail().timer > self._tail().duration:
+            self._drop_tail()
+
+    def clear(self):
+        self.count = 0
+        self.merging.clear()
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        start = self.head - self.count
+        for i in range(start, self.head):
+            yield self.slots[i % len(self.slots)]
+
+
+floating_texts = FloatingTextPool(FLOATING_TEXT_CAP)
 
 
 def spawn_floating_text(x, y, text, color):
-    floating_texts.append(FloatingText(x, y, text, color))
+    floating_texts.spawn(x, y, text, color)
+
+
+def spawn_damage_number(unit, amount):
+    floating_texts.add_damage(unit['id'], unit['x'], unit['y'], amount, RED)
 
 
 # ----- Helper Functions -----
-def in_mountain(x, y):
-    for m in mountains:
-        if m[0] <= x <= m[2] and m[1] <= y <= m[3]: return True
+def in_rects(rects, x, y):
+    for r in rects:
+        if r[0] <= x <= r[2] and r[1] <= y <= r[3]: return True
     return False
 
 
+def in_mountain(x, y):
+    return in_rects(mountains, x, y)
+
+
 def in_river(x, y):
-    for r in rivers:
-        if r[0] <= x <= r[2] and r[1] <= y <= r[3]: return True
-    return False
+    return in_rects(rivers, x, y)
 
 
 def draw_text(surface, text, font, color, pos):
@@ -220,6 +540,22 @@ def draw_text(surface, text, font, color, pos):
     surface.blit(textobj, pos)
 
 
+# HUD text is only re-rendered when the event bus reports a change (see invalidate_hud)
+hud_cache = {}
+
+
+def hud_text(key, text, font, color):
+    surf = hud_cache.get(key)
+    if surf is None:
+        surf = hud_cache[key] = font.render(text, True, color)
+    return surf
+
+
+def invalidate_hud(owner, **event):
+    hud_cache.pop(("treasury", owner), None)
+    hud_cache.pop(("units", owner), None)
+
+
 def draw_rounded_rect(surface, rect, color, radius=10, border=0, border_color=None):
     x, y, w, h = rect
     shape_surf = pygame.Surface((w, h), pygame.SRCALPHA)
@@ -252,6 +588,9 @@ def draw_home():
     draw_rounded_rect(screen, tut_rect, GREY, radius=15, border=3, border_color=BLACK)
     draw_text(screen, "Tutorial", FONT_MEDIUM, WHITE, (tut_rect.x + 75, tut_rect.y + 10))
 
+    if not assets_ready():
+        draw_text(screen, "Loading...", FONT_SMALL, GREY, (10, HEIGHT - 25))
+
     return {'single': sp_rect, 'multi': mp_rect, 'tutorial': tut_rect}
 
 
@@ -304,86 +643,341 @@ def draw_tutorial():
 # ----- Territory & Logic -----
 
 # 1. Initialize Territory Grid
-def init_territory(map_name):
+def territory_fills(map_name):
+    # Starting territory as (owner, rect) fills, applied in order
+    fills = []
     if map_name in ["classic_bridge", "mountain_pass"]:
-        territory_surface.fill(MAP_AI, (0, 0, TERRITORY_W, TERRITORY_H // 2))
-        territory_surface.fill(MAP_PLAYER, (0, TERRITORY_H // 2, TERRITORY_W, TERRITORY_H // 2))
+        fills += [('ai', (0, 0, TERRITORY_W, TERRITORY_H // 2)),
+                  ('player', (0, TERRITORY_H // 2, TERRITORY_W, TERRITORY_H // 2))]
     elif map_name in ["twin_islands", "crossroads"]:
-        territory_surface.fill(MAP_PLAYER, (0, 0, TERRITORY_W // 2, TERRITORY_H))
-        territory_surface.fill(MAP_AI, (TERRITORY_W // 2, 0, TERRITORY_W // 2, TERRITORY_H))
+        fills += [('player', (0, 0, TERRITORY_W // 2, TERRITORY_H)),
+                  ('ai', (TERRITORY_W // 2, 0, TERRITORY_W // 2, TERRITORY_H))]
     if map_name == "crossroads":
-        territory_surface.fill(MAP_PLAYER, (0, TERRITORY_H // 2, TERRITORY_W // 2, TERRITORY_H // 2))
-        territory_surface.fill(MAP_AI, (TERRITORY_W // 2, 0, TERRITORY_W // 2, TERRITORY_H // 2))
+        fills += [('player', (0, TERRITORY_H // 2, TERRITORY_W // 2, TERRITORY_H // 2)),
+                  ('ai', (TERRITORY_W // 2, 0, TERRITORY_W // 2, TERRITORY_H // 2))]
+    return fills
+
+
+def fill_territory(grid, owner, rect):
+    x, y, w, h = rect
+    grid[y:y + h, x:x + w] = TERRITORY_OWNERS.index(owner)
+
+
+def init_territory(map_name):
+    territory[:] = 0
+    territory_surface.fill(BLACK)
+    for owner, rect in territory_fills(map_name):
+        fill_territory(territory, owner, rect)
+        territory_surface.fill(TERRITORY_COLORS[owner], rect)
 
 
 # 2. Update Territory Grid (THE FIXED FUNCTION)
+# Cells covered by pygame.draw.circle(..., 2), so painting matches the old surface drawing
+TERRITORY_STENCIL = [(dx, dy) for dy in range(-2, 2) for dx in range(-2, 2)
+                     if (dx + 0.5) ** 2 + (dy + 0.5) ** 2 <= 2.5]
+
+
+def paint_territory(x, y, owner):
+    old = territory[y, x]
+    territory[y, x] = TERRITORY_OWNERS.index(owner)
+    territory_surface.set_at((x, y), TERRITORY_COLORS[owner])
+    counts = aggregates["territory"]
+    if old:
+        counts[TERRITORY_OWNERS[old]] -= 1
+    counts[owner] += 1
+    for unit in sleep_cells.pop((x, y), ()):
+        wake_unit(unit)
+    city = city_territory_cells.get((x, y))
+    if city:
+        capture_city(city, owner)
+
+
 def update_territory():
-    for unit in player_units:
-        pygame.draw.circle(territory_surface, MAP_PLAYER,
-                           (int(unit["x"] / TERRITORY_SCALE), int(unit["y"] / TERRITORY_SCALE)), 2)
-    for unit in enemy_units:
-        pygame.draw.circle(territory_surface, MAP_AI,
-                           (int(unit["x"] / TERRITORY_SCALE), int(unit["y"] / TERRITORY_SCALE)), 2)
+    for owner, units in (('player', player_units), ('ai', enemy_units)):
+        code = TERRITORY_OWNERS.index(owner)
+        for unit in units:
+            if unit['asleep']: continue  # its cells are still its side's, or it would be awake
+            cx, cy = int(unit["x"] / TERRITORY_SCALE), int(unit["y"] / TERRITORY_SCALE)
+            for dx, dy in TERRITORY_STENCIL:
+                x, y = cx + dx, cy + dy
+                if 0 <= x < TERRITORY_W and 0 <= y < TERRITORY_H and territory[y, x] != code:
+                    paint_territory(x, y, owner)
 
 
 # 3. Check Captures
+# Captures happen when paint_territory flips a city's cell; the full scan only runs
+# once per map to settle cities that start on someone else's ground.
+def capture_city(city, owner):
+    old = city['owner']
+    if old == owner:
+        return
+    city['owner'] = owner
+    city['color'] = YELLOW if owner == 'player' else ORANGE
+    emit(EVT_CITY_CAPTURED, city=city, old_owner=old, new_owner=owner)
+
+
 def check_city_capture():
+    city_territory_cells.clear()
     for city in cities:
         tx, ty = int(city['pos'][0] / TERRITORY_SCALE), int(city['pos'][1] / TERRITORY_SCALE)
         tx = max(0, min(TERRITORY_W - 1, tx))
         ty = max(0, min(TERRITORY_H - 1, ty))
-        try:
-            color = territory_surface.get_at((tx, ty))[:3]
-            if city['owner'] == 'ai' and color == MAP_PLAYER:
-                city['owner'] = 'player'
-                city['color'] = YELLOW
-            elif city['owner'] == 'player' and color == MAP_AI:
-                city['owner'] = 'ai'
-                city['color'] = ORANGE
-            elif city['owner'] == 'neutral':
-                if color == MAP_PLAYER:
-                    city['owner'], city['color'] = 'player', YELLOW
-                elif color == MAP_AI:
-                    city['owner'], city['color'] = 'ai', ORANGE
-        except:
+        city_territory_cells[(tx, ty)] = city
+        if territory[ty, tx]:
+            capture_city(city, TERRITORY_OWNERS[territory[ty, tx]])
+
+
+# ----- Game Events & Aggregates -----
+# State changes are announced on a small event bus. Counts that used to be
+# rescanned every frame are kept up to date by the handlers below.
+EVT_UNIT_SPAWNED = "unit_spawned"
+EVT_UNIT_DIED = "unit_died"
+EVT_CITY_CAPTURED = "city_captured"
+EVT_TREASURY_CHANGED = "treasury_changed"
+EVT_GAME_OVER = "game_over"
+
+event_handlers = {}
+
+aggregates = {
+    "cities": {"player": [], "ai": [], "neutral": []},
+    "units": {"player": {"troop": 0, "tank": 0}, "ai": {"troop": 0, "tank": 0}},
+    "income": {"player": 0, "ai": 0},
+    "territory": {"player": 0, "ai": 0},
+}
+
+
+def subscribe(event, handler):
+    event_handlers.setdefault(event, []).append(handler)
+
+
+def emit(event, **data):
+    for handler in event_handlers.get(event, ()):
+        handler(**data)
+
+
+def unit_count(owner):
+    return sum(aggregates["units"][owner].values())
+
+
+def territory_share(owner):
+    return aggregates["territory"][owner] / (TERRITORY_W * TERRITORY_H)
+
+
+def update_income():
+    aggregates["income"]["player"] = 10 + len(aggregates["cities"]["player"]) * 20
+    aggregates["income"]["ai"] = 15 + len(aggregates["cities"]["ai"]) * 20
+
+
+def reset_aggregates():
+    for owner in ("player", "ai"):
+        units = player_units if owner == 'player' else enemy_units
+        for u_type in ("troop", "tank"):
+            aggregates["units"][owner][u_type] = sum(1 for u in units if u['type'] == u_type)
+        aggregates["territory"][owner] = int(np.count_nonzero(territory == TERRITORY_OWNERS.index(owner)))
+    for owner, owned in aggregates["cities"].items():
+        owned[:] = [c for c in cities if c['owner'] == owner]
+    update_income()
+    hud_cache.clear()
+
+
+def on_unit_spawned(unit, owner):
+    aggregates["units"][owner][unit['type']] += 1
+
+
+def on_unit_died(unit, owner):
+    aggregates["units"][owner][unit['type']] -= 1
+
+
+def on_city_captured(city, old_owner, new_owner):
+    aggregates["cities"][old_owner].remove(city)
+    aggregates["cities"][new_owner].append(city)
+    update_income()
+
+
+def add_unit(owner, unit):
+    (player_units if owner == 'player' else enemy_units).append(unit)
+    emit(EVT_UNIT_SPAWNED, unit=unit, owner=owner)
+
+
+def change_treasury(owner, amount):
+    global treasury_p1, treasury_p2
+    if owner == 'player':
+        old = treasury_p1
+        treasury_p1 += amount
+        new = treasury_p1
+    else:
+        old = treasury_p2
+        treasury_p2 += amount
+        new = treasury_p2
+    if int(new) != int(old):
+        emit(EVT_TREASURY_CHANGED, owner=owner, old=old, new=new)
+
+
+# ----- Targeting Index -----
+# Per-map travel-cost fields from every city on the AI grid, so target lookups
+# are a table read instead of a scan. Mountains block, rivers halve speed.
+RIVER_COST = 2.0
+UNREACHABLE_COST = 10000.0
+CITY_RADIUS = 15
+GRID_NEIGHBORS = [(-1, 0, 1.0), (1, 0, 1.0), (0, -1, 1.0), (0, 1, 1.0),
+                   (-1, -1, 1.414), (1, -1, 1.414), (-1, 1, 1.414), (1, 1, 1.414)]
+
+city_fields = np.zeros((0, GRID_H, GRID_W), dtype=np.float32)
+city_cells = {}
+nearest_city_cache = {}
+
+
+def grid_cell(x, y):
+    gx = max(0, min(GRID_W - 1, int(x // GRID_SIZE)))
+    gy = max(0, min(GRID_H - 1, int(y // GRID_SIZE)))
+    return gx, gy
+
+
+def build_cost_grid(river_rects, mountain_rects):
+    cost = []
+    for gy in range(GRID_H):
+        row = []
+        for gx in range(GRID_W):
+            cx, cy = gx * GRID_SIZE + GRID_SIZE / 2, gy * GRID_SIZE + GRID_SIZE / 2
+            if in_rects(mountain_rects, cx, cy):
+                row.append(math.inf)
+            elif in_rects(river_rects, cx, cy):
+                row.append(RIVER_COST)
+            else:
+                row.append(1.0)
+        cost.append(row)
+    return cost
+
+
+def build_travel_field(cost, start):
+    # Dijkstra outward from the city. Expanding cell a -> b means a unit walks b -> a,
+    # so the step is charged at a's cost; units may leave a mountain but never enter one.
+    field = [[math.inf] * GRID_W for _ in range(GRID_H)]
+    sx, sy = start
+    field[sy][sx] = 0.0
+    heap = [(0.0, sx, sy)]
+    while heap:
+        d, gx, gy = heapq.heappop(heap)
+        if d > field[gy][gx] or cost[gy][gx] == math.inf:
             continue
+        for ox, oy, step in GRID_NEIGHBORS:
+            nx, ny = gx + ox, gy + oy
+            if 0 <= nx < GRID_W and 0 <= ny < GRID_H:
+                nd = d + step * cost[gy][gx] * GRID_SIZE
+                if nd < field[ny][nx]:
+                    field[ny][nx] = nd
+                    heapq.heappush(heap, (nd, nx, ny))
+    return np.array(field, dtype=np.float32)
+
+
+def build_city_fields(city_list, river_rects, mountain_rects):
+    # (cities, GRID_H, GRID_W) travel cost from every grid cell to each city
+    cost = build_cost_grid(river_rects, mountain_rects)
+    gx_centers = np.arange(GRID_W) * GRID_SIZE + GRID_SIZE / 2
+    gy_centers = np.arange(GRID_H) * GRID_SIZE + GRID_SIZE / 2
+    fields = []
+    for city in city_list:
+        field = build_travel_field(cost, grid_cell(*city['pos']))
+        # Enclosed cells fall back to straight-line distance behind a large penalty
+        straight = np.hypot(gx_centers[None, :] - city['pos'][0], gy_centers[:, None] - city['pos'][1])
+        fields.append(np.where(np.isinf(field), straight + UNREACHABLE_COST, field))
+    return np.array(fields, dtype=np.float32).reshape((len(city_list), GRID_H, GRID_W))
+
+
+def build_target_index():
+    global city_fields, city_cells
+    city_fields = build_city_fields(cities, rivers, mountains)
+
+    # Buckets of cities whose click radius touches each grid cell
+    city_cells = {}
+    for city in cities:
+        x0, y0 = grid_cell(city['pos'][0] - CITY_RADIUS, city['pos'][1] - CITY_RADIUS)
+        x1, y1 = grid_cell(city['pos'][0] + CITY_RADIUS, city['pos'][1] + CITY_RADIUS)
+        for gy in range(y0, y1 + 1):
+            for gx in range(x0, x1 + 1):
+                city_cells.setdefault((gx, gy), []).append(city)
+    nearest_city_cache.clear()
+
+
+def nearest_city_map(exclude_owner, city_list=None, fields=None):
+    # Grid of city indices (-1 = none), cached until city ownership changes.
+    # city_list/fields default to the live map; the AI worker passes its snapshot.
+    city_list = cities if city_list is None else city_list
+    fields = city_fields if fields is None else fields
+    key = (exclude_owner, tuple(c['owner'] for c in city_list), id(fields))
+    nearest = nearest_city_cache.get(key)
+    if nearest is None:
+        idx = np.array([i for i, c in enumerate(city_list) if c['owner'] != exclude_owner], dtype=np.int32)
+        if len(idx):
+            nearest = idx[np.argmin(fields[idx], axis=0)]
+        else:
+            nearest = np.full((GRID_H, GRID_W), -1, dtype=np.int32)
+        nearest_city_cache[key] = nearest
+    return nearest
 
 
-def create_unit(x, y, u_type):
-    global unit_id_counter
-    unit_id_counter += 1
-    max_hp = 150 if u_type == "tank" else 80
-    return {"id": unit_id_counter, "x": x, "y": y, "tx": x, "ty": y, "type": u_type, "hp": max_hp, "max_hp": max_hp}
+def nearest_target_city(x, y, exclude_owner, city_list=None, fields=None):
+    city_list = cities if city_list is None else city_list
+    gx, gy = grid_cell(x, y)
+    i = nearest_city_map(exclude_owner, city_list, fields)[gy, gx]
+    return city_list[i] if i >= 0 else None
 
 
-def init_game(map_name, mode):
-    global treasury_p1, treasury_p2, player_units, enemy_units, placing_phase, selected_units, cities
-    global ai_think_timer, ai_buy_timer, game_result, unit_id_counter, mountains, rivers, current_map_name
-    global player_spawn_zone, enemy_spawn_zone, game_mode, state, turn_timer, floating_texts, stats
+def city_at(x, y):
+    for c in city_cells.get(grid_cell(x, y), ()):
+        if math.hypot(x - c['pos'][0], y - c['pos'][1]) < CITY_RADIUS:
+            return c
+    return None
 
-    game_mode = mode
-    treasury_p1 = 10000
-    treasury_p2 = 1200
-    selected_units.clear()
-    player_units.clear()
-    enemy_units.clear()
-    cities.clear()
-    mountains.clear()
-    rivers.clear()
-    floating_texts.clear()
-    ai_think_timer = 0
-    ai_buy_timer = 0
-    game_result = ""
-    unit_id_counter = 0
-    current_map_name = map_name
-    turn_timer = 0
 
-    # Reset Stats
-    stats = {"kills": 0, "losses": 0, "money_earned": 500, "start_time": pygame.time.get_ticks(), "end_time": 0}
+class UnitGrid:
+    # Uniform bucket grid over unit positions, rebuilt whenever positions are needed
+    def __init__(self, units, cell=GRID_SIZE * 2):
+        self.cell = cell
+        self.buckets = {}
+        for u in units:
+            self.buckets.setdefault((int(u['x'] // cell), int(u['y'] // cell)), []).append(u)
+
+    def nearest(self, x, y):
+        if not self.buckets:
+            return None
+        cx, cy = int(x // self.cell), int(y // self.cell)
+        best, best_d = None, math.inf
+        max_ring = max(WIDTH, HEIGHT) // self.cell + 2
+        for ring in range(max_ring + 1):
+            for gx in range(cx - ring, cx + ring + 1):
+                for gy in range(cy - ring, cy + ring + 1):
+                    if ring and cx - ring < gx < cx + ring and cy - ring < gy < cy + ring:
+                        continue
+                    for u in self.buckets.get((gx, gy), ()):
+                        d = math.hypot(u['x'] - x, u['y'] - y)
+                        if d < best_d:
+                            best, best_d = u, d
+            # Anything in an unvisited ring is at least ring * cell away
+            if best is not None and best_d <= ring * self.cell:
+                break
+        return best
+
+    def near(self, x, y, radius):
+        # Candidates from the buckets overlapping the circle; callers check the distance
+        for gx in range(int((x - radius) // self.cell), int((x + radius) // self.cell) + 1):
+            for gy in range(int((y - radius) // self.cell), int((y + radius) // self.cell) + 1):
+                yield from self.buckets.get((gx, gy), ())
 
-    init_territory(map_name)
 
-    # --- Map Data ---
+def create_unit(x, y, u_type):
+    global unit_id_counter
+    unit_id_counter += 1
+    max_hp = UNIT_HP[u_type]
+    return {"id": unit_id_counter, "x": x, "y": y, "tx": x, "ty": y, "type": u_type, "hp": max_hp, "max_hp": max_hp,
+            "asleep": None}
+
+
+def map_layout(map_name):
+    # Terrain, starting cities and spawn zones of a map, as fresh objects
+    rivers, mountains, cities = [], [], []
+    player_spawn_zone = pygame.Rect(0, 0, 0, 0)
+    enemy_spawn_zone = pygame.Rect(0, 0, 0, 0)
     if map_name == "classic_bridge":
         rivers = [[0, 280, 280, 320], [320, 280, WIDTH, 320]]
         mountains = [[100, 100, 200, 200], [WIDTH - 200, 100, WIDTH - 100, 200],
@@ -431,6 +1025,51 @@ def init_game(map_name, mode):
         ]
         player_spawn_zone = pygame.Rect(0, HEIGHT // 2, WIDTH // 2, HEIGHT // 2)
         enemy_spawn_zone = pygame.Rect(WIDTH // 2, 0, WIDTH // 2, HEIGHT // 2)
+    return {"rivers": rivers, "mountains": mountains, "cities": cities,
+            "player_zone": player_spawn_zone, "enemy_zone": enemy_spawn_zone}
+
+
+def init_game(map_name, mode):
+    global treasury_p1, treasury_p2, player_units, enemy_units, placing_phase, selected_units, cities
+    global ai_think_timer, ai_buy_timer, game_result, unit_id_counter, mountains, rivers, current_map_name
+    global player_spawn_zone, enemy_spawn_zone, game_mode, state, turn_timer, floating_texts, stats
+
+    stop_telemetry()  # before the reset, so the last sample is still the old match's
+    game_mode = mode
+    treasury_p1 = 10000
+    treasury_p2 = 1200
+    selected_units.clear()
+    player_units.clear()
+    enemy_units.clear()
+    cities.clear()
+    mountains.clear()
+    rivers.clear()
+    floating_texts.clear()
+    particles.clear()
+    ai_think_timer = 0
+    ai_buy_timer = 0
+    game_result = ""
+    unit_id_counter = 0
+    current_map_name = map_name
+    turn_timer = 0
+    reset_ai_planning()
+    reset_preview()
+    sleep_cells.clear()
+
+    # Reset Stats
+    stats = {"kills": 0, "losses": 0, "money_earned": 500, "start_time": pygame.time.get_ticks(), "end_time": 0}
+
+    init_territory(map_name)
+
+    layout = map_layout(map_name)
+    rivers, mountains, cities = layout['rivers'], layout['mountains'], layout['cities']
+    player_spawn_zone, enemy_spawn_zone = layout['player_zone'], layout['enemy_zone']
+
+    build_target_index()
+    reset_aggregates()
+    check_city_capture()
+    start_telemetry(map_name)
+    trace_memory("restart")
 
     if game_mode == "single":
         placing_phase = True
@@ -442,8 +1081,13 @@ def init_game(map_name, mode):
         state = STATE_MP_SETUP_P1
 
 
+# Canvas and scaled territory map reused by draw_game instead of allocated every frame
+game_canvas = None
+scaled_territory = None
+
+
 def draw_game():
-    global screen_shake
+    global screen_shake, game_canvas, scaled_territory
 
     # 1. Setup Shake
     render_offset = [0, 0]
@@ -453,12 +1097,15 @@ def draw_game():
         screen_shake -= 1
 
         # 2. Create and Fill the Canvas
-    display_surf = pygame.Surface((WIDTH, HEIGHT))
+    if game_canvas is None:
+        game_canvas = pygame.Surface((WIDTH, HEIGHT))
+        scaled_territory = pygame.Surface((WIDTH, HEIGHT))
+    display_surf = game_canvas
     display_surf.fill(LIGHT_GREY)
 
     # 3. Territory Map
-    scaled_map = pygame.transform.scale(territory_surface, (WIDTH, HEIGHT))
-    display_surf.blit(scaled_map, (0, 0))  # FIXED: was screen.blit
+    pygame.transform.scale(territory_surface, (WIDTH, HEIGHT), scaled_territory)
+    display_surf.blit(scaled_territory, (0, 0))  # FIXED: was screen.blit
 
     # 4. Rivers
     for r in rivers:
@@ -486,13 +1133,12 @@ def draw_game():
         # The radius now uses (14 + pulse)
         pygame.draw.circle(display_surf, ring_color, city['pos'], int(14 + pulse), 2)
 
-        mx, my = pygame.mouse.get_pos()
-        for c in cities:
-            if math.hypot(mx - c['pos'][0], my - c['pos'][1]) < 15:
-                # Draw a small tooltip box
-                pygame.draw.rect(display_surf, BLACK, (mx + 10, my + 10, 80, 25))
-                income_text = FONT_TINY.render(f"+$10/sec", True, GOLD)
-                display_surf.blit(income_text, (mx + 15, my + 15))
+    mx, my = logical_mouse_pos()
+    if city_at(mx, my):
+        # Draw a small tooltip box
+        pygame.draw.rect(display_surf, BLACK, (mx + 10, my + 10, 80, 25))
+        income_text = FONT_TINY.render(f"+$10/sec", True, GOLD)
+        display_surf.blit(income_text, (mx + 15, my + 15))
 
     # 7. Units (Updated helper function inside draw_game)
     def draw_unit_to_surf(u, is_player):
@@ -522,7 +1168,7 @@ def draw_game():
     # Make sure your draw_text function uses display_surf inside its logic,
     # or just blit the text surfaces to display_surf here.
     if game_mode == "single":
-        money_txt = FONT_MEDIUM.render(f"Treasury: ${int(treasury_p1)}", True, BLACK)
+        money_txt = hud_text(("treasury", "player"), f"Treasury: ${int(treasury_p1)}", FONT_MEDIUM, BLACK)
         display_surf.blit(money_txt, (10, 10))
 
     # 10. FINAL BLIT: Only here do we use 'screen'
@@ -549,6 +1195,8 @@ def draw_game():
     for ft in floating_texts:
         ft.draw(screen)
 
+    if state in MP_ORDER_STATES:
+        draw_preview()
     if state == STATE_MP_ORDER_P1:
         for u in player_units:
             if u["id"] in selected_units: pygame.draw.line(screen, WHITE, (u['x'], u['y']), (u['tx'], u['ty']), 1)
@@ -557,22 +1205,22 @@ def draw_game():
             if u["id"] in selected_units: pygame.draw.line(screen, WHITE, (u['x'], u['y']), (u['tx'], u['ty']), 1)
 
     if game_mode == "single":
-        draw_text(screen, f"Treasury: ${int(treasury_p1)}", FONT_MEDIUM, BLACK, (10, 10))
+        screen.blit(hud_text(("treasury", "player"), f"Treasury: ${int(treasury_p1)}", FONT_MEDIUM, BLACK), (10, 10))
     else:
-        draw_text(screen, f"P1: ${int(treasury_p1)}", FONT_MEDIUM, DARK_GREEN, (10, 10))
-        draw_text(screen, f"P2: ${int(treasury_p2)}", FONT_MEDIUM, RED, (WIDTH - 150, 10))
+        screen.blit(hud_text(("treasury", "player"), f"P1: ${int(treasury_p1)}", FONT_MEDIUM, DARK_GREEN), (10, 10))
+        screen.blit(hud_text(("treasury", "ai"), f"P2: ${int(treasury_p2)}", FONT_MEDIUM, RED), (WIDTH - 150, 10))
 
     msg, color = "", BLACK
     if state == STATE_GAME and placing_phase:
         msg, color = "Place Units (Space to Start)", DARK_GREEN
     elif state == STATE_MP_SETUP_P1:
-        msg, color = f"P1 Setup ({MAX_UNITS - len(player_units)} left) - Space", DARK_GREEN
+        msg, color = f"P1 Setup ({MAX_UNITS - unit_count('player')} left) - Space", DARK_GREEN
     elif state == STATE_MP_SETUP_P2:
-        msg, color = f"P2 Setup ({MAX_UNITS - len(enemy_units)} left) - Space", RED
+        msg, color = f"P2 Setup ({MAX_UNITS - unit_count('ai')} left) - Space", RED
     elif state == STATE_MP_ORDER_P1:
-        msg, color = "P1 Turn: Order Troops - Space", DARK_GREEN
+        msg, color = f"P1 Turn: Order Troops - Space (I: instant {'on' if instant_resolve else 'off'})", DARK_GREEN
     elif state == STATE_MP_ORDER_P2:
-        msg, color = "P2 Turn: Order Troops - Space", RED
+        msg, color = f"P2 Turn: Order Troops - Space (I: instant {'on' if instant_resolve else 'off'})", RED
     elif state == STATE_MP_RESOLVE:
         msg, color = f"RESOLVING... {int(turn_timer / 60)}s", BLACK
 
@@ -586,50 +1234,537 @@ def draw_game():
 
         # Unit Counters
         draw_rounded_rect(screen, (10, 50, 120, 60), (0, 0, 0, 150))
-        draw_text(screen, f"Units: {len(player_units)}/{MAX_UNITS}", FONT_TINY, WHITE, (20, 60))
-        draw_text(screen, f"Enemy: {len(enemy_units)}", FONT_TINY, RED, (20, 80))
+        screen.blit(hud_text(("units", "player"), f"Units: {unit_count('player')}/{MAX_UNITS}", FONT_TINY, WHITE), (20, 60))
+        screen.blit(hud_text(("units", "ai"), f"Enemy: {unit_count('ai')}", FONT_TINY, RED), (20, 80))
+
+    if show_memory:
+        draw_memory_overlay()
+
+
+# ----- AI Policy -----
+# A small MLP scores candidate targets (every city, the nearest enemy unit, or holding
+# position) for a whole army in one batched call. Features are side-relative, so the
+# same weights drive either side in headless self-play (see train_policy.py).
+POLICY_FEATURES = 13
+
+
+def load_policy():
+    # Loaded once and cached; False marks "no weights file", falling back to the heuristic
+    global ai_policy
+    if ai_policy is None:
+        ai_policy = False
+        if os.path.exists(POLICY_PATH):
+            with np.load(POLICY_PATH) as data:
+                params = {k: data[k].astype(np.float32) for k in data.files}
+            if AI_POLICY_BACKEND == "tensorflow":
+                tf = get_tf()
+                params = {k: tf.constant(v) for k, v in params.items()}
+            ai_policy = params
+    return ai_policy or None
+
+
+def policy_scores(policy, features):
+    if AI_POLICY_BACKEND == "tensorflow":
+        tf = get_tf()
+        x = (tf.constant(features) - policy['mean']) / policy['std']
+        h = tf.nn.relu(tf.matmul(x, policy['w1']) + policy['b1'])
+        return (tf.matmul(h, policy['w2']) + policy['b2']).numpy()[:, 0]
+    x = (features - policy['mean']) / policy['std']
+    h = np.maximum(x @ policy['w1'] + policy['b1'], 0)
+    return (h @ policy['w2'] + policy['b2'])[:, 0]
+
+
+def unit_cells(pos):
+    gx = np.clip((pos[:, 0] // GRID_SIZE).astype(np.int32), 0, GRID_W - 1)
+    gy = np.clip((pos[:, 1] // GRID_SIZE).astype(np.int32), 0, GRID_H - 1)
+    return gx, gy
+
+
+def influence_map(pos):
+    # Unit density on the AI grid, smoothed with KERNEL
+    density = np.zeros(GRID_H * GRID_W, dtype=np.float32)
+    if len(pos):
+        gx, gy = unit_cells(pos)
+        density = np.bincount(gy * GRID_W + gx, minlength=GRID_H * GRID_W).astype(np.float32)
+    density = density.reshape(GRID_H, GRID_W)
+    padded = np.pad(density, 2)
+    kernel = KERNEL[:, :, 0, 0]
+    result = np.zeros_like(density)
+    for ky in range(5):
+        for kx in range(5):
+            result += kernel[ky, kx] * padded[ky:ky + GRID_H, kx:kx + GRID_W]
+    return result
+
+
+def shift_grid(grid, ox, oy, fill):
+    # out[y, x] = grid[y + oy, x + ox]
+    out = np.full_like(grid, fill)
+    h, w = grid.shape[:2]
+    out[max(0, -oy):h - max(0, oy), max(0, -ox):w - max(0, ox)] = \
+        grid[max(0, oy):h - max(0, -oy), max(0, ox):w - max(0, -ox)]
+    return out
+
+
+def nearest_unit_map(pos):
+    # Jump flooding: for each grid cell, the position of (approximately) the closest unit.
+    # Cost depends on the grid size, not the army size.
+    far = 1e6
+    seeds = np.full((GRID_H, GRID_W, 2), far, dtype=np.float32)
+    if not len(pos):
+        return seeds
+    gx, gy = unit_cells(pos)
+    seeds[gy, gx] = pos
+    cy, cx = np.mgrid[0:GRID_H, 0:GRID_W].astype(np.float32) * GRID_SIZE + GRID_SIZE / 2
+    best = (seeds[..., 0] - cx) ** 2 + (seeds[..., 1] - cy) ** 2
+    step = max(GRID_W, GRID_H) // 2
+    while step >= 1:
+        for oy in (-step, 0, step):
+            for ox in (-step, 0, step):
+                if ox or oy:
+                    cand = shift_grid(seeds, ox, oy, far)
+                    d = (cand[..., 0] - cx) ** 2 + (cand[..., 1] - cy) ** 2
+                    better = d < best
+                    seeds = np.where(better[..., None], cand, seeds)
+                    best = np.minimum(d, best)
+        step //= 2
+    return seeds
+
+
+def territory_grid(grid, owner):
+    # Fraction of each AI grid cell owned by the given side
+    mask = (grid == TERRITORY_OWNERS.index(owner)).astype(np.float32)
+    f = GRID_SIZE // TERRITORY_SCALE
+    return mask[:GRID_H * f, :GRID_W * f].reshape(GRID_H, f, GRID_W, f).mean(axis=(1, 3))
+
+
+def build_policy_features(snap, agents):
+    # agents: (N, 4) rows of x, y, hp fraction, tank share, one per squad.
+    # Returns features (N, K, F), candidate target positions (N, K, 2) and a validity mask (N, K)
+    units, enemies, owner, snap_cities = snap['units'], snap['enemies'], snap['owner'], snap['cities']
+    n, n_cities = len(agents), len(snap_cities)
+    k = n_cities + 2
+    own = agents
+    pos = own[:, :2]
+    enemy_pos = np.array([(e['x'], e['y']) for e in enemies], dtype=np.float32).reshape(len(enemies), 2)
+    unit_pos = np.array([(u['x'], u['y']) for u in units], dtype=np.float32).reshape(len(units), 2)
+    gx, gy = unit_cells(pos)
+
+    enemy_terr = territory_grid(snap['territory'], 'ai' if owner == 'player' else 'player')
+    enemy_infl = influence_map(enemy_pos)
+    own_infl = influence_map(unit_pos)
+    nearest_enemy = nearest_unit_map(enemy_pos)[gy, gx]
+
+    cand = np.empty((n, k, 2), dtype=np.float32)
+    cand[:, :n_cities] = [c['pos'] for c in snap_cities]
+    cand[:, n_cities] = nearest_enemy
+    cand[:, n_cities + 1] = pos
+    cgx, cgy = unit_cells(cand.reshape(-1, 2))
+    cgx, cgy = cgx.reshape(n, k), cgy.reshape(n, k)
+
+    feats = np.zeros((n, k, POLICY_FEATURES), dtype=np.float32)
+    if n_cities:
+        feats[:, :n_cities, 0] = snap['fields'][:, gy, gx].T / 1000.0
+    feats[:, n_cities, 0] = np.hypot(*(nearest_enemy - pos).T) / 1000.0
+    owners = [c['owner'] for c in snap_cities]
+    feats[:, :n_cities, 1] = [o == owner for o in owners]
+    feats[:, :n_cities, 2] = [o not in (owner, 'neutral') for o in owners]
+    feats[:, :n_cities, 3] = [o == 'neutral' for o in owners]
+    feats[:, n_cities, 4] = 1.0
+    feats[:, n_cities + 1, 5] = 1.0
+    feats[:, :, 6] = enemy_infl[cgy, cgx]
+    feats[:, :, 7] = own_infl[cgy, cgx]
+    feats[:, :, 8] = enemy_terr[cgy, cgx]
+    feats[:, :, 9] = own[:, 2:3]
+    feats[:, :, 10] = own[:, 3:4]
+    feats[:, :, 11] = owners.count(owner) / max(1, n_cities)
+    feats[:, :, 12] = len(units) / max(1, len(units) + len(enemies))
+
+    valid = np.ones((n, k), dtype=bool)
+    valid[:, n_cities] = len(enemies) > 0
+    return feats, cand, valid
+
+
+def plan_nearest_targets(snap, agents):
+    # Heuristic used when no policy weights are available; NaN where there is no target
+    enemy_grid = UnitGrid(snap['enemies'])
+    targets = np.full((len(agents), 2), np.nan, dtype=np.float32)
+    for i, (x, y) in enumerate(agents[:, :2].tolist()):
+        # Closest city the side doesn't own, by travel cost around terrain
+        closest_city = nearest_target_city(x, y, snap['owner'], snap['cities'], snap['fields'])
+        if closest_city:
+            targets[i] = closest_city['pos']
+        else:
+            # Fallback to nearest enemy unit if cities are all taken
+            closest = enemy_grid.nearest(x, y)
+            if closest:
+                targets[i] = closest['x'], closest['y']
+    return targets
+
+
+def heuristic_scores(feats):
+    # plan_nearest_targets expressed as candidate scores: the cheapest city not owned,
+    # then the nearest enemy unit, then holding position
+    n_cities = feats.shape[1] - 2
+    scores = np.full(feats.shape[:2], -1e5, dtype=np.float32)
+    scores[:, :n_cities] = np.where(feats[:, :n_cities, 1] > 0, -np.inf, -feats[:, :n_cities, 0])
+    scores[:, n_cities] = -1e4
+    return scores
+
+
+def plan_moves(snap, rng):
+    # One target per squad, then formation slots around it for the members
+    policy = load_policy()
+    explore = snap['explore']
+    agents, squad_of, changes = squad_agents(snap)
+    if not len(agents):
+        return [], changes
+    if policy is None and not explore:
+        return formation_moves(snap, squad_of, plan_nearest_targets(snap, agents)), changes
+    feats, cand, valid = build_policy_features(snap, agents)
+    n, k, f = feats.shape
+    if policy is not None:
+        scores = policy_scores(policy, feats.reshape(n * k, f)).reshape(n, k)
+    else:
+        scores = heuristic_scores(feats)
+    scores[~valid] = -np.inf
+    if explore:
+        # Exploration for self-play: random valid choice for a fraction of squads
+        noise = rng.random((n, k))
+        noise[~valid] = -1.0
+        pick = rng.random(n) < explore
+        scores[pick] = noise[pick]
+    choice = np.argmax(scores, axis=1)
+    if ai_decision_log is not None:
+        ai_decision_log.append((snap['owner'], feats, valid, choice))
+    return formation_moves(snap, squad_of, cand[np.arange(n), choice]), changes
+
+
+def plan_buy(snap, rng):
+    # Returns (city index, unit type) or None
+    owned = [i for i, c in enumerate(snap['cities']) if c['owner'] == snap['owner']]
+    if not owned or len(snap['units']) >= MAX_UNITS or snap['treasury'] < UNIT_COST["troop"]:
+        return None
+    u_type = "tank" if snap['treasury'] >= 600 else "troop"
+    return owned[int(rng.integers(len(owned)))], u_type
+
+
+# ----- Squads -----
+# The planner works on squads of nearby units rather than single units, so a think
+# costs one target search per squad. Membership is kept incrementally from events: a
+# spawned unit joins the nearest squad with room within SQUAD_JOIN_RADIUS (or starts
+# its own) and a dead unit leaves its squad. The planner also proposes splits (members
+# that strayed past SQUAD_LEASH) and merges of nearby small squads, which the main
+# thread applies along with the orders.
+SQUAD_MAX = 8
+SQUAD_JOIN_RADIUS = 60
+SQUAD_LEASH = 120
+SQUAD_SLOT_SPACING = SEPARATION_RADIUS + 4
+squads = {"player": {}, "ai": {}}  # owner -> {squad id: [unit, ...]}
+unit_squads = {}  # unit id -> squad id
+squad_id_counter = 0
+
+
+def formation_offsets(count, spacing):
+    # Hex-packed slots around the target, nearest first
+    points = [((i + 0.5 * (j % 2)) * spacing, j * spacing * 0.866) for j in range(-3, 4) for i in range(-3, 4)]
+    points.sort(key=lambda p: math.hypot(*p))
+    return np.array(points[:count], dtype=np.float32)
+
+
+FORMATION_OFFSETS = formation_offsets(SQUAD_MAX, SQUAD_SLOT_SPACING)
+FORMATION_SPAN = 2 * float(np.hypot(*FORMATION_OFFSETS.T).max())  # farthest a slot swap moves a target
+
+
+def reset_squads():
+    global squad_id_counter
+    for owned in squads.values():
+        owned.clear()
+    unit_squads.clear()
+    squad_id_counter = 0
+
+
+def squad_center(members):
+    return (sum(u['x'] for u in members) / len(members), sum(u['y'] for u in members) / len(members))
+
+
+def new_squad(owner, members):
+    global squad_id_counter
+    squad_id_counter += 1
+    squads[owner][squad_id_counter] = members
+    for u in members:
+        unit_squads[u['id']] = squad_id_counter
+
+
+def join_squad(unit, owner):
+    best, best_d = None, SQUAD_JOIN_RADIUS
+    for sid, members in squads[owner].items():
+        if len(members) < SQUAD_MAX:
+            cx, cy = squad_center(members)
+            d = math.hypot(unit['x'] - cx, unit['y'] - cy)
+            if d < best_d:
+                best, best_d = sid, d
+    if best is None:
+        new_squad(owner, [unit])
+    else:
+        squads[owner][best].append(unit)
+        unit_squads[unit['id']] = best
+
+
+def leave_squad(unit, owner):
+    sid = unit_squads.pop(unit['id'], None)
+    members = squads[owner].get(sid)
+    if members is None: return
+    members[:] = [u for u in members if u['id'] != unit['id']]
+    if not members:
+        del squads[owner][sid]
+
+
+def apply_squad_changes(owner, changes, by_id):
+    # Main thread: splits and merges proposed by the planner, re-checked against the live squads
+    owned = squads[owner]
+    for ids in changes['split']:
+        members = [by_id[uid] for uid in ids if uid in by_id]
+        for u in members:
+            leave_squad(u, owner)
+        if members:
+            new_squad(owner, members)
+    for sa, sb in changes['merge']:
+        if sa in owned and sb in owned and len(owned[sa]) + len(owned[sb]) <= SQUAD_MAX:
+            for u in owned[sb]:
+                unit_squads[u['id']] = sa
+            owned[sa] += owned.pop(sb)
+
+
+def squad_agents(snap):
+    # Per-squad planning rows (x, y, hp fraction, tank share), the squad row of every
+    # unit in snap['units'] and the squad changes to send back to the main thread:
+    # members past SQUAD_LEASH (and units in no squad) split off into new squads by
+    # area, and close squads that fit together merge.
+    units = snap['units']
+    index = {u['id']: i for i, u in enumerate(units)}
+    own = np.array([(u['x'], u['y'], u['hp'] / u['max_hp'], u['type'] == "tank") for u in units],
+                   dtype=np.float32).reshape(len(units), 4)
+    squad_of = np.full(len(units), -1, dtype=np.int64)
+    sids = list(snap['squads'])
+    pairs = [(index[uid], k) for k, ids in enumerate(snap['squads'].values()) for uid in ids if uid in index]
+    if pairs:
+        rows, ks = np.array(pairs, dtype=np.int64).T
+        # Renumber so squads whose members all died get no row
+        live, squad_of[rows] = np.unique(ks, return_inverse=True)
+        sids = [sids[k] for k in live.tolist()]
+    else:
+        sids = []
+
+    def centers(n):
+        has = squad_of >= 0
+        sizes = np.bincount(squad_of[has], minlength=n)
+        sums = np.stack([np.bincount(squad_of[has], own[has, c], n) for c in range(4)], -1)
+        return sums / np.maximum(sizes, 1)[:, None], sizes
+
+    agents, sizes = centers(len(sids))
+    has = squad_of >= 0
+    far = np.zeros(len(units), dtype=bool)
+    far[has] = np.hypot(*(own[has, :2] - agents[squad_of[has], :2]).T) > SQUAD_LEASH
+    squad_of[far] = -1
+
+    split, buckets = [], {}
+    for i in np.nonzero(squad_of < 0)[0].tolist():
+        buckets.setdefault((int(own[i, 0] // SQUAD_JOIN_RADIUS), int(own[i, 1] // SQUAD_JOIN_RADIUS)), []).append(i)
+    for rows in buckets.values():
+        for k in range(0, len(rows), SQUAD_MAX):
+            squad_of[rows[k:k + SQUAD_MAX]] = len(sids) + len(split)
+            split.append([units[i]['id'] for i in rows[k:k + SQUAD_MAX]])
+    if split or far.any():
+        agents, sizes = centers(len(sids) + len(split))
+
+    merge, merged = [], set()
+    small = np.nonzero(sizes[:len(sids)] < SQUAD_MAX)[0]
+    if len(small) > 1:
+        pos = agents[small, :2]
+        d = np.hypot(*(pos[:, None] - pos[None, :]).transpose(2, 0, 1))
+        close = (d < SQUAD_JOIN_RADIUS) & (sizes[small, None] + sizes[None, small] <= SQUAD_MAX)
+        for a, b in zip(*np.nonzero(np.triu(close, 1))):
+            a, b = int(small[a]), int(small[b])
+            if a not in merged and b not in merged:
+                merge.append((sids[a], sids[b]))
+                merged.update((a, b))
+    return agents.astype(np.float32), squad_of, {"split": split, "merge": merge}
+
+
+def formation_moves(snap, squad_of, targets):
+    # Closest member to the target takes the centre slot, and so on outwards
+    units = snap['units']
+    rows = np.nonzero(squad_of >= 0)[0]
+    rows = rows[~np.isnan(targets[squad_of[rows], 0])]
+    if not len(rows):
+        return []
+    pos = np.array([(units[i]['x'], units[i]['y']) for i in rows.tolist()], dtype=np.float32)
+    squad = squad_of[rows]
+    target = targets[squad]
+    order = np.lexsort((np.hypot(*(pos - target).T), squad))
+    squad = squad[order]
+    rank = np.arange(len(order)) - np.searchsorted(squad, squad)
+    slots = np.clip(target[order] + FORMATION_OFFSETS[rank % SQUAD_MAX], 10, (WIDTH - 10, HEIGHT - 10))
+    return [(units[i]['id'], x, y) for i, (x, y) in zip(rows[order].tolist(), slots.tolist())]
+
+
+# ----- AI Planning -----
+# Planning reads only a private snapshot (copied unit dicts, city owners, territory),
+# so it can run on a worker thread while the main thread keeps simulating and
+# drawing. Its orders are tagged with the tick the snapshot was taken on and applied
+# on the main thread at tick + AI_ORDER_DELAY, never mid-tick. Randomness comes from
+# a generator seeded by (match seed, tick, side), so the same snapshot always yields
+# the same orders, whichever thread computes them.
+AI_WORKER = True
+AI_ORDER_DELAY = 1
+ORDER_TOLERANCE = 3  # px an AI target must move by to count as a new order
+AI_WAIT_FOR_ORDERS = False  # block on late orders instead of applying them late (reproducible runs)
+ai_seed = 0
+ai_generation = 0
+ai_pending = []
+ai_late_orders = 0  # ticks on which a due order batch was still being planned
+ai_wait_for_orders = AI_WAIT_FOR_ORDERS
+ai_worker = None
+headless_explore = 0.0
+
+
+def reset_ai_planning():
+    # Orders from the previous match still in flight are dropped by generation
+    global ai_generation, ai_seed, ai_late_orders, ai_wait_for_orders
+    drain_ai_orders()
+    reset_squads()
+    ai_generation += 1
+    ai_seed = random.getrandbits(32)
+    ai_late_orders = 0
+    ai_wait_for_orders = AI_WAIT_FOR_ORDERS
+
+
+def take_ai_snapshot(owner, think=True, buy=False):
+    units, enemies = (enemy_units, player_units) if owner == 'ai' else (player_units, enemy_units)
+    return {
+        "tick": game_tick,
+        "generation": ai_generation,
+        "owner": owner,
+        "think": think,
+        "buy": buy,
+        "explore": AI_EXPLORE if owner == 'ai' else headless_explore,
+        "units": [dict(u) for u in units],
+        "squads": {sid: [u['id'] for u in members] for sid, members in squads[owner].items()},
+        "enemies": [dict(e) for e in enemies],
+        "cities": [dict(c) for c in cities],
+        "fields": city_fields,
+        "territory": territory.copy(),
+        "treasury": treasury_p2 if owner == 'ai' else treasury_p1,
+    }
+
+
+def plan_ai_orders(snap):
+    rng = np.random.default_rng([ai_seed, snap['tick'], 0 if snap['owner'] == 'player' else 1])
+    moves, squad_changes = plan_moves(snap, rng) if snap['think'] else ([], None)
+    return {
+        "tick": snap['tick'],
+        "generation": snap['generation'],
+        "owner": snap['owner'],
+        "moves": moves,
+        "squads": squad_changes,
+        "buy": plan_buy(snap, rng) if snap['buy'] else None,
+    }
+
+
+def apply_ai_orders(orders):
+    owner = orders['owner']
+    units = enemy_units if owner == 'ai' else player_units
+    if orders['moves'] or orders['squads']:
+        by_id = {u['id']: u for u in units}
+        for uid, tx, ty in orders['moves']:
+            u = by_id.get(uid)
+            if u is None: continue  # died since the snapshot
+            # Only a new order wakes a unit. The planner re-sends every target each
+            # think, and a parked unit whose squad only reshuffled its slots keeps its spot.
+            tolerance = FORMATION_SPAN if u['asleep'] else ORDER_TOLERANCE
+            if math.hypot(tx - u['tx'], ty - u['ty']) > tolerance:
+                u['tx'], u['ty'] = tx, ty
+                wake_unit(u)
+        if orders['squads']:
+            apply_squad_changes(owner, orders['squads'], by_id)
+    if orders['buy']:
+        city_index, u_type = orders['buy']
+        cost = UNIT_COST[u_type]
+        city = cities[city_index]
+        treasury = treasury_p2 if owner == 'ai' else treasury_p1
+        # Re-check against the live state: the city may have fallen in the meantime
+        if city['owner'] == owner and unit_count(owner) < MAX_UNITS and treasury >= cost:
+            if spawn_unit(owner, city['pos'], u_type):
+                change_treasury(owner, -cost)
+
+
+class AIWorker:
+    def __init__(self):
+        self.requests = queue.Queue()
+        self.results = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            snap = self.requests.get()
+            try:
+                self.results.put(plan_ai_orders(snap))
+            except Exception as e:
+                print(f"AI planning failed: {e}")
+                self.results.put({"generation": -1})  # keeps results in step with requests
+
+
+def request_ai_orders(owner, think, buy):
+    global ai_worker
+    snap = take_ai_snapshot(owner, think, buy)
+    if not AI_WORKER:
+        ai_pending.append(plan_ai_orders(snap))
+        return
+    if ai_worker is None:
+        ai_worker = AIWorker()
+    ai_worker.requests.put(snap)
+    ai_pending.append(None)  # placeholder until the worker answers
+
+
+def apply_ready_ai_orders():
+    # Called at the start of a tick: applies every order batch that is due
+    global ai_late_orders
+    if ai_worker is not None:
+        while True:
+            try:
+                orders = ai_worker.results.get_nowait()
+            except queue.Empty:
+                break
+            ai_pending[ai_pending.index(None)] = orders
+    while ai_pending:
+        orders = ai_pending[0]
+        if orders is None:
+            # Still planning; only late if it was due already
+            ai_late_orders += 1
+            if not ai_wait_for_orders: return
+            ai_pending[0] = ai_worker.results.get()
+            continue
+        if orders['generation'] == ai_generation:
+            if orders['tick'] + AI_ORDER_DELAY > game_tick: return
+            apply_ai_orders(orders)
+        ai_pending.pop(0)
+
+
+def drain_ai_orders():
+    # Waits for every outstanding plan and discards it
+    while None in ai_pending:
+        ai_pending[ai_pending.index(None)] = ai_worker.results.get()
+    ai_pending.clear()
 
 
 def ai_buy_units():
-    global treasury_p2
-    ai_cities = [c for c in cities if c['owner'] == 'ai']
-    if not ai_cities: return
-    if len(enemy_units) < MAX_UNITS:
-        if treasury_p2 >= 350:
-            target_city = random.choice(ai_cities)
-            u_type = "tank" if treasury_p2 >= 600 else "troop"
-            cost = 500 if u_type == "tank" else 350
-            if treasury_p2 >= cost:
-                treasury_p2 -= cost
-                spawn_unit('ai', target_city['pos'], u_type)
+    apply_ai_orders(plan_ai_orders(take_ai_snapshot('ai', think=False, buy=True)))
 
 
 def run_tensorflow_movement():
-    # ... (keep your existing grid and influence map setup) ...
-
-    for u in enemy_units:
-        gx, gy = int(u['x'] // GRID_SIZE), int(u['y'] // GRID_SIZE)
-        best_x, best_y, max_val = u['x'], u['y'], -999.0
-
-        # 1. Search for best target on Influence Map (Units/Territory)
-        target_found = False
-        # ... (keep your existing loop for result_map) ...
-
-        # 2. STRATEGY BUG FIX: If no immediate threat, target the nearest Player City
-        if not target_found or max_val < 0.5:
-            # Filter for cities the AI doesn't own
-            targets = [c for c in cities if c['owner'] != 'ai']
-            if targets:
-                # Find the closest city and move toward it
-                closest_city = min(targets, key=lambda c: math.hypot(c['pos'][0] - u['x'], c['pos'][1] - u['y']))
-                u['tx'], u['ty'] = closest_city['pos'][0], closest_city['pos'][1]
-            elif player_units:
-                # Fallback to nearest player unit if cities are all taken
-                closest = min(player_units, key=lambda p: math.hypot(p['x'] - u['x'], p['y'] - u['y']))
-                u['tx'], u['ty'] = closest['x'], closest['y']
-        else:
-            # Use influence map result
-            u['tx'], u['ty'] = best_x + random.randint(-15, 15), best_y + random.randint(-15, 15)
+    apply_ai_orders(plan_ai_orders(take_ai_snapshot('ai')))
+
 
 def spawn_unit(owner, pos, u_type):
     global treasury_p1, treasury_p2
@@ -644,15 +1779,11 @@ def spawn_unit(owner, pos, u_type):
         if not in_mountain(sx, sy):
             collision = False
             for u in player_units + enemy_units:
-                if math.hypot(u['x'] - sx, u['y'] - sy) < 12:
+                if math.hypot(u['x'] - sx, u['y'] - sy) < SEPARATION_RADIUS:
                     collision = True
                     break
             if not collision:
-                u_obj = create_unit(sx, sy, u_type)
-                if owner == 'player':
-                    player_units.append(u_obj)
-                else:
-                    enemy_units.append(u_obj)
+                add_unit(owner, create_unit(sx, sy, u_type))
                 return True
     return False
 
@@ -662,24 +1793,65 @@ def purchase_menu(city, btn):  # Added btn parameter
     if state == STATE_MP_ORDER_P2: current_owner = 'ai'
     if city['owner'] != current_owner: return
 
-    global treasury_p1
     # Check button: 1 is Left Click (Troop), 3 is Right Click (Tank)
     u_type = "tank" if btn == 3 else "troop"
-    cost = 500 if u_type == "tank" else 350
+    cost = UNIT_COST[u_type]
 
     if treasury_p1 >= cost:
         if spawn_unit('player', city['pos'], u_type):
-            treasury_p1 -= cost
-            if sfx_spawn: sfx_spawn.play()
+            change_treasury('player', -cost)
+            audio.play("spawn", city['pos'])
+
+
+# ----- Sleeping Units -----
+# A unit at its target with nobody inside its separation radius would not move, so it
+# goes to sleep and skips the movement and territory passes. It wakes on a new order,
+# when an awake unit comes within SEPARATION_RADIUS + SLEEP_MARGIN (the margin covers
+# a tick of movement), when it takes damage, or when a territory cell it holds flips.
+# Sleepers still fight. sleep_cells maps territory cells to the units asleep on them.
+SLEEP_MARGIN = 8
+sleep_cells = {}
+awake_units = 0
+
+
+def sleep_unit(unit, code):
+    cx, cy = int(unit["x"] / TERRITORY_SCALE), int(unit["y"] / TERRITORY_SCALE)
+    cells = [(cx + dx, cy + dy) for dx, dy in TERRITORY_STENCIL
+             if 0 <= cx + dx < TERRITORY_W and 0 <= cy + dy < TERRITORY_H]
+    # Only once the territory it would paint is all its side's
+    if any(territory[y, x] != code for x, y in cells): return
+    unit['asleep'] = cells
+    for cell in cells:
+        sleep_cells.setdefault(cell, []).append(unit)
+
+
+def wake_unit(unit, **event):
+    cells = unit['asleep']
+    if cells is None: return
+    unit['asleep'] = None
+    for cell in cells:
+        sleepers = sleep_cells.get(cell)
+        if sleepers and unit in sleepers:
+            sleepers.remove(unit)
+            if not sleepers:
+                del sleep_cells[cell]
+
+
+def end_resolve_turn():
+    global state
+    state = STATE_MP_ORDER_P1
+    selected_units.clear()
+    for u in player_units + enemy_units:
+        u['tx'], u['ty'] = u['x'], u['y']
+        wake_unit(u)
 
 
 def update_units(dt):
-    global player_losses, ai_losses, ai_think_timer, ai_buy_timer, state, player_units, enemy_units, selected_units, turn_timer, stats, d
+    global player_losses, ai_losses, ai_think_timer, ai_buy_timer, player_units, enemy_units, selected_units, turn_timer, stats, d
+    global awake_units
 
     # Update Floating Text
-    for ft in floating_texts[:]:
-        ft.update()
-        if ft.timer > ft.duration: floating_texts.remove(ft)
+    floating_texts.update()
 
     moving = False
     if game_mode == "single" and not placing_phase:
@@ -689,35 +1861,47 @@ def update_units(dt):
 
     if moving:
         if game_mode == "single":
+            apply_ready_ai_orders()
             ai_buy_timer += 1
-            if ai_buy_timer >= AI_BUY_INTERVAL:
-                ai_buy_units()
-                ai_buy_timer = 0
             ai_think_timer += 1
-            if ai_think_timer >= AI_THINK_INTERVAL:
-                run_tensorflow_movement()
-                ai_think_timer = 0
+            buy, think = ai_buy_timer >= AI_BUY_INTERVAL, ai_think_timer >= AI_THINK_INTERVAL
+            if buy: ai_buy_timer = 0
+            if think: ai_think_timer = 0
+            if buy or think:
+                request_ai_orders('ai', think, buy)
 
         if state == STATE_MP_RESOLVE:
             turn_timer -= 1
             if turn_timer <= 0:
-                state = STATE_MP_ORDER_P1
-                selected_units.clear()
-                for u in player_units + enemy_units: u['tx'], u['ty'] = u['x'], u['y']
+                end_resolve_turn()
 
         all_units = player_units + enemy_units
-        for i, unit in enumerate(all_units):
+        grid = UnitGrid(all_units, SEPARATION_RADIUS * 2)
+        reach = SEPARATION_RADIUS + SLEEP_MARGIN
+        # Sleepers that an awake unit may push this tick wake up first
+        for unit in all_units:
+            if not unit['asleep']:
+                for other in grid.near(unit['x'], unit['y'], reach):
+                    if other['asleep'] and math.hypot(unit['x'] - other['x'], unit['y'] - other['y']) < reach:
+                        wake_unit(other)
+        awake = [(u, 1 if i < len(player_units) else 2) for i, u in enumerate(all_units) if not u['asleep']]
+        awake_units = len(awake)
+
+        for unit, code in awake:
             dx, dy = unit["tx"] - unit["x"], unit["ty"] - unit["y"]
             dist = math.hypot(dx, dy)
             sep_x, sep_y = 0, 0
-            for other in all_units:
-                if unit != other:
+            crowded = False
+            for other in grid.near(unit['x'], unit['y'], reach):
+                if unit is not other:
                     d_x, d_y = unit['x'] - other['x'], unit['y'] - other['y']
                     d = math.hypot(d_x, d_y)
-                    if d < 12 and d > 0:
-                        force = (12 - d) / 2
-                        sep_x += (d_x / d) * force
-                        sep_y += (d_y / d) * force
+                    if d < SEPARATION_RADIUS:
+                        crowded = True
+                        if d > 0:
+                            force = (SEPARATION_RADIUS - d) / 2
+                            sep_x += (d_x / d) * force
+                            sep_y += (d_y / d) * force
             if dist > 2:
                 speed = TANK_SPEED if unit["type"] == "tank" else TROOP_SPEED
                 if in_river(unit["x"], unit["y"]): speed *= 0.5
@@ -732,80 +1916,91 @@ def update_units(dt):
                         unit["y"] = ny
                 else:
                     unit["x"], unit["y"] = nx, ny
-            else:
+            elif crowded:
                 unit["x"] += sep_x
                 unit["y"] += sep_y
+            else:
+                sleep_unit(unit, code)
 
+        global combat_pairs
         damage_pairs = []
+        enemy_grid = UnitGrid(enemy_units, COMBAT_RADIUS * 2)
         for p in player_units:
-            for e in enemy_units:
-                if math.hypot(p['x'] - e['x'], p['y'] - e['y']) < 18:
+            for e in enemy_grid.near(p['x'], p['y'], COMBAT_RADIUS):
+                if math.hypot(p['x'] - e['x'], p['y'] - e['y']) < COMBAT_RADIUS:
                     damage_pairs.append((p, e))
 
+        combat_pairs = len(damage_pairs)
         for p, e in damage_pairs:
-            if random.random() < 0.1:
-                p_dmg = 5 if e['type'] == "troop" else 8
-                e_dmg = 5 if p['type'] == "troop" else 8
+            if random.random() < HIT_CHANCE:
+                p_dmg = UNIT_DAMAGE[e['type']]
+                e_dmg = UNIT_DAMAGE[p['type']]
                 p['hp'] -= p_dmg
                 e['hp'] -= e_dmg
-                spawn_floating_text(p['x'], p['y'], f"-{p_dmg}", RED)
-                spawn_floating_text(e['x'], e['y'], f"-{e_dmg}", RED)
-
-                # Count losses
-                dead_p = [u for u in player_units if u['hp'] <= 0]
-                dead_e = [u for u in enemy_units if u['hp'] <= 0]
-
-                # Trigger VFX and Sound for dead units
-                for d in (dead_p + dead_e):
-                    global screen_shake
-                    # This was the error line - we ensure d is the unit dictionary
-                    screen_shake = 8 if d['type'] == "tank" else 4
-
-                    # Trigger Explosion Sound
-                    if sfx_explosion:
-                        sfx_explosion.play()
-
-                    # Particle effects (optional polish)
-                    p_color = DARK_GREEN if d in dead_p else RED
-                    if d['type'] == "tank": p_color = GREY
-                    for _ in range(10):
-                        particles.append(Particle(d['x'], d['y'], p_color))
-
-                # Update stats
-                stats['losses'] += len(dead_p)
-                stats['kills'] += len(dead_e)
-
-                # Remove dead units from the game lists
-                player_units = [u for u in player_units if u['hp'] > 0]
-                enemy_units = [u for u in enemy_units if u['hp'] > 0]
-
-                # --- NEW LOSS & WIN LOGIC ---
-                # 1. Count how many cities each side owns
-                p_cities = sum(1 for c in cities if c['owner'] == 'player')
-                ai_cities = sum(1 for c in cities if c['owner'] == 'ai')
-
-                # 2. Check for Loss: You have 0 cities AND 0 units
-                if p_cities == 0 and not player_units:
-                    game_result = "loss"
-                    state = STATE_END
-                    stats['end_time'] = pygame.time.get_ticks()
-
-                # 3. Check for Win: AI has 0 cities AND 0 units
-                elif ai_cities == 0 and not enemy_units:
-                    game_result = "win"
-                    state = STATE_END
-                    stats['end_time'] = pygame.time.get_ticks()
+                wake_unit(p)
+                wake_unit(e)
+                spawn_damage_number(p, p_dmg)
+                spawn_damage_number(e, e_dmg)
+
+                # Remove dead units from the game lists, then announce them
+                dead = [(u, 'player') for u in player_units if u['hp'] <= 0] + \
+                       [(u, 'ai') for u in enemy_units if u['hp'] <= 0]
+                if dead:
+                    player_units = [u for u in player_units if u['hp'] > 0]
+                    enemy_units = [u for u in enemy_units if u['hp'] > 0]
+                    for d, owner in dead:
+                        emit(EVT_UNIT_DIED, unit=d, owner=owner)
+
+
+def death_effects(unit, owner):
+    global screen_shake
+    screen_shake = 8 if unit['type'] == "tank" else 4
+
+    # Trigger Explosion Sound
+    audio.play("explosion", (unit['x'], unit['y']))
+
+    # Particle effects (optional polish)
+    p_color = DARK_GREEN if owner == 'player' else RED
+    if unit['type'] == "tank": p_color = GREY
+    for _ in range(10):
+        particles.append(Particle(unit['x'], unit['y'], p_color))
+    del particles[:-PARTICLE_CAP]  # oldest first when a big fight outpaces the fade
+
+
+def record_death_stats(unit, owner):
+    stats['losses' if owner == 'player' else 'kills'] += 1
+
+
+def check_game_over(**event):
+    # --- LOSS & WIN LOGIC --- (runs only when a unit dies or a city changes hands)
+    global game_result, state
+    if state == STATE_END: return
+
+    # Loss: you have 0 cities AND 0 units
+    if not aggregates["cities"]["player"] and unit_count('player') == 0:
+        game_result = "loss"
+
+    # Win: AI has 0 cities AND 0 units
+    elif not aggregates["cities"]["ai"] and unit_count('ai') == 0:
+        game_result = "win"
+    else:
+        return
+    state = STATE_END
+    stats['end_time'] = pygame.time.get_ticks()
+    emit(EVT_GAME_OVER, result=game_result)
+
 
 def game_events(event):
-    global placing_phase, selected_units, state, turn_timer, treasury_p1
+    global placing_phase, selected_units, state, turn_timer, show_preview, show_memory
+    global instant_resolve
 
     # --- HANDLE MOUSE CLICKS ---
     if event.type == pygame.MOUSEBUTTONDOWN:
-        mx, my = pygame.mouse.get_pos()
-        for c in cities:
-            if math.hypot(mx - c['pos'][0], my - c['pos'][1]) < 15:
-                purchase_menu(c, event.button)  # Pass event.button here!
-                return
+        mx, my = logical_mouse_pos()
+        c = city_at(mx, my)
+        if c:
+            purchase_menu(c, event.button)  # Pass event.button here!
+            return
 
         # 2. Setup Phases (Placement)
         # Fix: Removed the treasury cost check here so placement is free
@@ -813,20 +2008,19 @@ def game_events(event):
             u = "tank" if event.button == 3 else "troop"
             if len(player_units) < MAX_UNITS:
                 spawn_unit("player", (mx, my), u)
-                if sfx_spawn:
-                    sfx_spawn.play()
+                audio.play("spawn", (mx, my))
             return
 
         if state == STATE_MP_SETUP_P1 and player_spawn_zone.collidepoint(mx, my):
             u = "tank" if event.button == 3 else "troop"
-            if len(player_units) < MAX_UNITS: player_units.append(create_unit(mx, my, u))
-            if sfx_spawn: sfx_spawn.play()
+            if len(player_units) < MAX_UNITS: add_unit('player', create_unit(mx, my, u))
+            audio.play("spawn", (mx, my))
             return
 
         if state == STATE_MP_SETUP_P2 and enemy_spawn_zone.collidepoint(mx, my):
             u = "tank" if event.button == 3 else "troop"
-            if len(enemy_units) < MAX_UNITS: enemy_units.append(create_unit(mx, my, u))
-            if sfx_spawn: sfx_spawn.play()
+            if len(enemy_units) < MAX_UNITS: add_unit('ai', create_unit(mx, my, u))
+            audio.play("spawn", (mx, my))
             return
 
         # 3. Unit Selection and Movement Orders
@@ -852,6 +2046,7 @@ def game_events(event):
                     if u:
                         u['tx'] = mx + random.randint(-15, 15)
                         u['ty'] = my + random.randint(-15, 15)
+                        wake_unit(u)
                 if game_mode == "single": selected_units.clear()
 
     # --- HANDLE KEYPRESSES (SPACEBAR) ---
@@ -859,7 +2054,7 @@ def game_events(event):
         if state == STATE_GAME and placing_phase:
             placing_phase = False
             # Ensure treasury starts at a normal level when game begins
-            treasury_p1 = 500
+            change_treasury('player', 500 - treasury_p1)
         elif state == STATE_MP_SETUP_P1:
             state = STATE_MP_SETUP_P2;
             selected_units.clear()
@@ -873,19 +2068,34 @@ def game_events(event):
             state = STATE_MP_RESOLVE;
             selected_units.clear();
             turn_timer = TURN_DURATION
+            start_resolve()
+        elif state == STATE_MP_RESOLVE and resolve_record:
+            replay_resolve_tick(skip=True)
+
+    if event.type == pygame.KEYDOWN and event.key == pygame.K_p and state in MP_ORDER_STATES:
+        show_preview = not show_preview
+    if event.type == pygame.KEYDOWN and event.key == pygame.K_i and state in MP_ORDER_STATES:
+        instant_resolve = not instant_resolve
+
+    if event.type == pygame.KEYDOWN and event.key == pygame.K_F2:
+        set_render_mode(RENDER_MODES[(RENDER_MODES.index(RENDER_MODE) + 1) % len(RENDER_MODES)])
+
+    if event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+        show_memory = not show_memory
+        memory_lines.clear()
 
 
 def update_treasury(delta):
-    global treasury_p1, treasury_p2
-    p_inc_count = sum(1 for c in cities if c['owner'] == 'player')
-    a_inc_count = sum(1 for c in cities if c['owner'] == 'ai')
+    earn_income(aggregates["income"]["player"] * delta, aggregates["income"]["ai"] * delta)
+
 
+def earn_income(p1_amount, p2_amount):
     old_p1 = int(treasury_p1)
-    treasury_p1 += (10 + p_inc_count * 20) * delta
-    treasury_p2 += (15 + a_inc_count * 20) * delta
+    change_treasury('player', p1_amount)
+    change_treasury('ai', p2_amount)
 
     if int(treasury_p1) > old_p1 and int(treasury_p1) % 10 == 0:
-        my_cities = [c for c in cities if c['owner'] == 'player']
+        my_cities = aggregates["cities"]["player"]
         if my_cities:
             c = random.choice(my_cities)
             spawn_floating_text(c['pos'][0], c['pos'][1] - 20, "+$$$", GOLD)
@@ -930,9 +2140,750 @@ def draw_end_screen():
     draw_text(screen, "Return to Menu", FONT_MEDIUM, WHITE, (r.x + 15, r.y + 10))
     return r
 
+# ----- Telemetry -----
+# Time-series of a match for balancing and performance analysis. The main thread
+# only builds a small dict every TELEMETRY_SAMPLE_TICKS; a writer thread appends it
+# as JSONL to telemetry/<map>_<time>.jsonl. The queue is bounded, so if the disk
+# stalls samples are dropped (and counted) instead of piling up in memory. Only the
+# newest TELEMETRY_KEEP_FILES matches are kept on disk.
+TELEMETRY_ENABLED = True
+TELEMETRY_KEEP_FILES = 20
+TELEMETRY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "telemetry")
+TELEMETRY_SAMPLE_TICKS = FPS
+TELEMETRY_QUEUE_SIZE = 256
+CITY_OWNER_CODES = {"neutral": 0, "player": 1, "ai": 2}
+
+game_tick = 0
+combat_pairs = 0
+last_frame_ms = 0.0
+telemetry = None
+
+
+class TelemetryRecorder:
+    def __init__(self, path, header):
+        self.path = path
+        self.queue = queue.Queue(maxsize=TELEMETRY_QUEUE_SIZE)
+        self.dropped = 0
+        self.failed = False  # set by the writer when it can't write; samples are dropped from then on
+        self.record(header)
+        self.thread = threading.Thread(target=self._write, daemon=True)
+        self.thread.start()
+
+    def record(self, sample):
+        if self.failed:
+            self.dropped += 1
+            return
+        try:
+            self.queue.put_nowait(sample)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        # Bounded waits: a dead or stuck writer must not hang game over or quit
+        deadline = time.perf_counter() + 5
+        while not self.failed:
+            try:
+                self.queue.put(None, timeout=0.1)
+                break
+            except queue.Full:
+                if time.perf_counter() > deadline:
+                    self.failed = True
+        self.thread.join(timeout=5)
+
+    def _write(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            prune_telemetry(os.path.dirname(self.path), TELEMETRY_KEEP_FILES - 1)
+            with open(self.path, "a", buffering=64 * 1024) as f:
+                while True:
+                    sample = self.queue.get()
+                    if sample is None:
+                        break
+                    f.write(json.dumps(sample, separators=(",", ":")) + "\n")
+        except (OSError, TypeError, ValueError) as e:
+            self.failed = True
+            print(f"Telemetry disabled, can't write {self.path}: {e}")
+
+
+def prune_telemetry(directory, keep):
+    # Oldest match files first, until `keep` remain. Best effort: another recorder
+    # may be pruning the same directory.
+    try:
+        files = [os.path.join(directory, f) for f in os.listdir(directory) if f.endswith(".jsonl")]
+        files.sort(key=os.path.getmtime)
+        for path in files[:max(0, len(files) - keep)]:
+            os.remove(path)
+    except OSError:
+        pass
+
+
+def start_telemetry(map_name):
+    global telemetry, game_tick
+    stop_telemetry()
+    game_tick = 0
+    if not TELEMETRY_ENABLED or not map_name: return
+    path = os.path.join(TELEMETRY_DIR, f"{map_name}_{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}.jsonl")
+    telemetry = TelemetryRecorder(path, {"map": map_name, "mode": game_mode, "sample_ticks": TELEMETRY_SAMPLE_TICKS,
+                                         "cities": [list(c['pos']) for c in cities]})
+
+
+def stop_telemetry(result=None):
+    global telemetry
+    if telemetry is None: return
+    sample_telemetry()
+    telemetry.record({"result": result, "dropped": telemetry.dropped})
+    telemetry.close()
+    telemetry = None
+
+
+def sample_telemetry():
+    units = aggregates["units"]
+    telemetry.record({
+        "tick": game_tick,
+        "player_troops": units["player"]["troop"], "player_tanks": units["player"]["tank"],
+        "ai_troops": units["ai"]["troop"], "ai_tanks": units["ai"]["tank"],
+        "player_treasury": round(treasury_p1, 1), "ai_treasury": round(treasury_p2, 1),
+        "player_cities": len(aggregates["cities"]["player"]), "ai_cities": len(aggregates["cities"]["ai"]),
+        "city_owners": [CITY_OWNER_CODES[c['owner']] for c in cities],
+        "player_territory": round(territory_share('player'), 4), "ai_territory": round(territory_share('ai'), 4),
+        "combat_pairs": combat_pairs,
+        "awake_units": awake_units,
+        "frame_ms": round(last_frame_ms, 2),
+    })
+
+
+def telemetry_tick():
+    global game_tick
+    game_tick += 1
+    if telemetry is not None and game_tick % TELEMETRY_SAMPLE_TICKS == 0:
+        sample_telemetry()
+
+
+def load_telemetry(path):
+    # Reads a match back as (header, {column: NumPy array}); city_owners is (samples, cities)
+    with open(path) as f:
+        lines = [json.loads(line) for line in f if line.strip()]
+    header, rows = lines[0], [r for r in lines[1:] if "tick" in r]
+    footer = next((r for r in lines[1:] if "result" in r), {})
+    header.update(footer)
+    columns = {key: np.array([r[key] for r in rows]) for key in (rows[0] if rows else {})}
+    return header, columns
+
+
+# ----- Memory Accounting -----
+# memory_report() counts every pool that can grow during a session and estimates its
+# bytes, so a leak shows up as a number before it shows up as a crash. F3 shows it in
+# game. With MEMORY_TRACE on, tracemalloc snapshots are diffed every
+# MEMORY_TRACE_FRAMES frames and across init_game restarts and the top growth is
+# printed. soak_test.py plays headless matches back-to-back on top of both.
+MEMORY_TRACE = False  # tracemalloc slows everything down while it is tracing
+MEMORY_TRACE_FRAMES = 600
+MEMORY_TRACE_TOP = 8
+show_memory = False
+memory_lines = []  # rendered overlay rows, refreshed once a second
+memory_frame = 0
+memory_snapshots = {}  # label -> the last tracemalloc snapshot taken under it
+
+
+def surface_bytes(surf):
+    return surf.get_pitch() * surf.get_height() if surf is not None else 0
+
+
+def dict_bytes(d):
+    return sys.getsizeof(d) + sum(sys.getsizeof(v) for v in d.values())
+
+
+def memory_report():
+    # {pool: (count, estimated bytes)}. Estimates cover each object and its own
+    # buffers, not shared strings/small ints or allocator overhead.
+    units = player_units + enemy_units
+    surfaces = list(hud_cache.values()) + list(particle_surfaces.values())
+    surfaces += [s for s in (screen, territory_surface, game_canvas, scaled_territory) if s is not None]
+    arrays = [territory, city_fields] + list(nearest_city_cache.values())
+    for env in mp_envs.values():
+        arrays += [a for a in vars(env).values() if isinstance(a, np.ndarray)]
+    if preview is not None:
+        arrays += preview["paths"] + preview["alive"]
+    if resolve_record is not None:
+        arrays += [a for frame in resolve_record[2] for a in frame]
+    return {
+        "units": (len(units), sum(dict_bytes(u) for u in units)),
+        "particles": (len(particles), sum(sys.getsizeof(p) + dict_bytes(vars(p)) for p in particles)),
+        # The pool is preallocated, so its bytes count every slot and cached render
+        "floating_texts": (len(floating_texts), sum(sys.getsizeof(ft) + surface_bytes(ft.surf) for ft in floating_texts.slots)),
+        "surfaces": (len(surfaces), sum(surface_bytes(s) for s in surfaces)),
+        "sim_arrays": (len(arrays), sum(a.nbytes for a in arrays)),
+        "ai_orders": (len(ai_pending), sum(sys.getsizeof(o) for o in ai_pending)),
+        "sleepers": (sum(len(v) for v in sleep_cells.values()), dict_bytes(sleep_cells)),
+        "squads": (sum(len(s) for s in squads.values()), dict_bytes(unit_squads)),
+    }
+
+
+def trace_memory(label):
+    # Diffs a fresh tracemalloc snapshot against the last one taken under label
+    if not MEMORY_TRACE: return
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    snap = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+    old, memory_snapshots[label] = memory_snapshots.get(label), snap
+    if old is None: return
+    stats = snap.compare_to(old, "lineno")
+    grown = sum(stat.size_diff for stat in stats)
+    print(f"[memory] {label}: {grown / 1024:+.1f} KB, {tracemalloc.get_traced_memory()[0] / 1024:.0f} KB traced")
+    for stat in stats[:MEMORY_TRACE_TOP]:
+        print(f"  {stat}")
+
+
+def memory_tick():
+    global memory_frame
+    memory_frame += 1
+    if memory_frame % MEMORY_TRACE_FRAMES == 0:
+        trace_memory("frames")
+    if show_memory and memory_frame % FPS == 0:
+        memory_lines.clear()
+
+
+def draw_memory_overlay():
+    if not memory_lines:
+        report = memory_report()
+        total = sum(b for _, b in report.values())
+        rows = [f"{name:<15}{count:>6}{b / 1024:>9.1f} KB" for name, (count, b) in report.items()]
+        rows.append(f"{'total':<21}{total / 1024:>9.1f} KB")
+        memory_lines.extend(FONT_TINY.render(row, True, WHITE) for row in rows)
+    width = max(line.get_width() for line in memory_lines) + 20
+    draw_rounded_rect(screen, (WIDTH - width - 10, 50, width, 18 * len(memory_lines) + 16), (0, 0, 0, 150))
+    for i, line in enumerate(memory_lines):
+        screen.blit(line, (WIDTH - width, 58 + 18 * i))
+
+
+# ----- Event Subscriptions -----
+# Aggregates first, so later handlers see updated counts
+subscribe(EVT_UNIT_SPAWNED, on_unit_spawned)
+subscribe(EVT_UNIT_DIED, on_unit_died)
+subscribe(EVT_CITY_CAPTURED, on_city_captured)
+subscribe(EVT_UNIT_SPAWNED, join_squad)
+subscribe(EVT_UNIT_DIED, wake_unit)
+subscribe(EVT_UNIT_DIED, leave_squad)
+subscribe(EVT_UNIT_DIED, record_death_stats)
+subscribe(EVT_UNIT_DIED, death_effects)
+subscribe(EVT_UNIT_DIED, check_game_over)
+subscribe(EVT_CITY_CAPTURED, check_game_over)
+for _event in (EVT_UNIT_SPAWNED, EVT_UNIT_DIED, EVT_TREASURY_CHANGED):
+    subscribe(_event, invalidate_hud)
+subscribe(EVT_GAME_OVER, stop_telemetry)
+
+
+def simulate_tick(dt):
+    if state == STATE_MP_RESOLVE and resolve_record:
+        replay_resolve_tick()
+    else:
+        update_treasury(dt)
+        update_territory()
+        update_units(dt)
+    update_particles()
+    telemetry_tick()
+
+
+# ----- Headless Self-Play -----
+# Runs whole matches without input or drawing; the player side is driven by the
+# same planner as the AI. Used by train_policy.py.
+def run_headless_match(map_name, max_ticks=3600, explore=0.0, on_tick=None):
+    global placing_phase, headless_explore, ai_wait_for_orders
+    init_game(map_name, "single")
+    for _ in range(MAX_UNITS):
+        spawn_unit('player', (player_spawn_zone.centerx, player_spawn_zone.centery), "troop")
+    placing_phase = False
+    change_treasury('player', 500 - treasury_p1)
+    headless_explore = explore
+    ai_wait_for_orders = True  # nobody is watching, so keep matches reproducible
+    dt = 1.0 / FPS
+    tick = 0
+    while tick < max_ticks and state != STATE_END:
+        buy, think = tick % AI_BUY_INTERVAL == 0, tick % AI_THINK_INTERVAL == 0
+        if buy or think:
+            request_ai_orders('player', think, buy)
+        simulate_tick(dt)
+        tick += 1
+        if on_tick:
+            on_tick(tick)
+    drain_ai_orders()
+    stop_telemetry(game_result or None)
+    return tick
+
+
+# ----- Vectorized Environments -----
+# VecWarOfDots runs E independent matches of one map as stacked NumPy arrays and
+# advances all of them with one step(), for batch AI training. It uses the rules of
+# update_treasury/update_territory/update_units, except that separation and combat
+# resolve for every unit at once (the live game updates units one at a time, so
+# later units see earlier ones already moved). Unit slots are fixed: the first
+# `capacity` slots of every env belong to the player, the rest to the AI.
+#
+# step(actions) takes a dict with optional keys
+#   "targets": (E, N, 2) move orders per unit slot, NaN keeps the current order
+#   "buy":     (E, 2, 2) per side (player, ai): [city index or -1, 1 for a tank]
+# and returns (obs, reward, terminated, truncated, info) like a Gym vector env.
+# Reward is from the player's side. Finished envs stay frozen until reset(envs).
+class VecWarOfDots:
+    def __init__(self, map_name, num_envs, capacity=MAX_UNITS, start_units=20, max_ticks=3600, seed=None,
+                 fields=None):
+        layout = map_layout(map_name)
+        self.map_name = map_name
+        self.num_envs = num_envs
+        self.capacity = capacity
+        self.start_units = start_units
+        self.max_ticks = max_ticks
+        self.rng = np.random.default_rng(seed)
+        self.rivers = np.array(layout['rivers'], dtype=np.float32).reshape(-1, 4)
+        self.mountains = np.array(layout['mountains'], dtype=np.float32).reshape(-1, 4)
+        self.city_pos = np.array([c['pos'] for c in layout['cities']], dtype=np.float32).reshape(-1, 2)
+        self.start_owners = np.array([CITY_OWNER_CODES[c['owner']] for c in layout['cities']], dtype=np.int8)
+        self.start_territory = np.zeros((TERRITORY_H, TERRITORY_W), dtype=np.int8)
+        for owner, rect in territory_fills(map_name):
+            fill_territory(self.start_territory, owner, rect)
+        # Callers on the live map can pass city_fields instead of rebuilding them
+        self.fields = build_city_fields(layout['cities'], layout['rivers'], layout['mountains']) \
+            if fields is None else fields
+        self.spawn_centers = np.array([layout['player_zone'].center, layout['enemy_zone'].center], dtype=np.float32)
+        self.city_cx = np.clip((self.city_pos[:, 0] / TERRITORY_SCALE).astype(int), 0, TERRITORY_W - 1)
+        self.city_cy = np.clip((self.city_pos[:, 1] / TERRITORY_SCALE).astype(int), 0, TERRITORY_H - 1)
+        self.stencil = np.array(TERRITORY_STENCIL, dtype=np.int64)
+
+        e, n = num_envs, 2 * capacity
+        self.side = np.repeat(np.array([1, 2], dtype=np.int8), capacity)
+        self.x = np.zeros((e, n), dtype=np.float32)
+        self.y = np.zeros((e, n), dtype=np.float32)
+        self.tx = np.zeros((e, n), dtype=np.float32)
+        self.ty = np.zeros((e, n), dtype=np.float32)
+        self.hp = np.zeros((e, n), dtype=np.float32)
+        self.tank = np.zeros((e, n), dtype=bool)
+        self.alive = np.zeros((e, n), dtype=bool)
+        self.territory = np.zeros((e, TERRITORY_H, TERRITORY_W), dtype=np.int8)
+        self.city_owner = np.zeros((e, len(self.city_pos)), dtype=np.int8)
+        self.treasury = np.zeros((e, 2), dtype=np.float64)
+        self.tick = np.zeros(e, dtype=np.int64)
+        self.done = np.zeros(e, dtype=bool)
+        self.result = np.zeros(e, dtype=np.int8)  # side code of the winner, 0 while running
+        self.engaged = np.zeros((e, n), dtype=bool)  # units in combat range on the last step
+        self.slot_ids = np.full(n, -1, dtype=np.int64)  # live unit ids after load_game()
+
+    def reset(self, envs=None):
+        envs = np.arange(self.num_envs) if envs is None else np.asarray(envs)
+        self.alive[envs] = False
+        self.territory[envs] = self.start_territory
+        terr = self.start_territory[self.city_cy, self.city_cx]
+        self.city_owner[envs] = np.where(terr != 0, terr, self.start_owners)
+        self.treasury[envs] = (500.0, 1200.0)
+        self.tick[envs] = 0
+        self.done[envs] = False
+        self.result[envs] = 0
+        # Starting armies are placed one unit per env at a time, so they don't overlap
+        for _ in range(self.start_units):
+            for side in (1, 2):
+                centers = np.broadcast_to(self.spawn_centers[side - 1], (len(envs), 2))
+                self._spawn(envs, side, centers, np.zeros(len(envs), dtype=bool))
+        self.tx[envs], self.ty[envs] = self.x[envs], self.y[envs]
+        return self.observe()
+
+    def load_game(self):
+        # Copies the live match into every env: an array-level clone of the unit dicts,
+        # territory, city owners and treasuries
+        self.alive[:] = False
+        self.slot_ids[:] = -1
+        for start, units in ((0, player_units), (self.capacity, enemy_units)):
+            rows = np.array([(u['x'], u['y'], u['tx'], u['ty'], u['hp'], u['type'] == "tank", u['id']) for u in units],
+                            dtype=np.float64).reshape(len(units), 7)
+            slots = slice(start, start + len(units))
+            self.x[:, slots], self.y[:, slots] = rows[:, 0], rows[:, 1]
+            self.tx[:, slots], self.ty[:, slots] = rows[:, 2], rows[:, 3]
+            self.hp[:, slots], self.tank[:, slots] = rows[:, 4], rows[:, 5]
+            self.alive[:, slots] = True
+            self.slot_ids[slots] = rows[:, 6]
+        self.territory[:] = territory
+        self.city_owner[:] = [CITY_OWNER_CODES[c['owner']] for c in cities]
+        self.treasury[:] = (treasury_p1, treasury_p2)
+        self.tick[:] = 0
+        self.done[:] = False
+        self.result[:] = 0
+
+    def observe(self):
+        # Arrays are live views of the env state; copy them to keep them past the next step
+        units = np.stack([self.x, self.y, self.hp / np.where(self.tank, UNIT_HP["tank"], UNIT_HP["troop"]),
+                          self.tank, self.alive], axis=-1).astype(np.float32)
+        return {"units": units, "cities": self.city_owner, "territory": self.territory, "treasury": self.treasury}
+
+    def step(self, actions=None):
+        actions = actions or {}
+        active = ~self.done
+        live = self.alive & active[:, None]
+        city_score = self._city_score()
+
+        # Same order as simulate_tick: income, territory, orders, movement, combat
+        owned = [(self.city_owner == side).sum(axis=1) for side in (1, 2)]
+        self.treasury[:, 0] += np.where(active, 10 + 20 * owned[0], 0) / FPS
+        self.treasury[:, 1] += np.where(active, 15 + 20 * owned[1], 0) / FPS
+        self._paint_territory(live)
+        self._apply_orders(actions, active)
+        live = self.alive & active[:, None]
+        self._move(live)
+        pairs = self._combat(live)
+
+        self.tick += active
+        units_left = [(self.alive[:, self.side == side]).any(axis=1) for side in (1, 2)]
+        cities_left = [(self.city_owner == side).any(axis=1) for side in (1, 2)]
+        player_lost = active & ~units_left[0] & ~cities_left[0]
+        ai_lost = active & ~player_lost & ~units_left[1] & ~cities_left[1]
+        self.result[player_lost] = 2
+        self.result[ai_lost] = 1
+        terminated = player_lost | ai_lost
+        truncated = active & ~terminated & (self.tick >= self.max_ticks)
+        self.done |= terminated | truncated
+
+        reward = (self._city_score() - city_score).astype(np.float32)
+        reward += np.where(ai_lost, 1.0, 0.0) - np.where(player_lost, 1.0, 0.0)
+        return self.observe(), reward, terminated, truncated, {"combat_pairs": pairs, "result": self.result}
+
+    def scripted_actions(self, think=True, buy=True):
+        # The heuristic AI for both sides: head for the cheapest city the side doesn't
+        # own (nearest enemy unit when it owns them all), buy like ai_buy_units
+        actions = {}
+        if think:
+            gx = np.clip((self.x // GRID_SIZE).astype(int), 0, GRID_W - 1)
+            gy = np.clip((self.y // GRID_SIZE).astype(int), 0, GRID_H - 1)
+            cost = np.moveaxis(self.fields[:, gy, gx], 0, -1)  # (E, N, C)
+            owned = self.city_owner[:, None, :] == self.side[None, :, None]
+            cost = np.where(owned, np.inf, cost)
+            best = np.argmin(cost, axis=2)
+            targets = self.city_pos[best]
+            no_city = np.isinf(np.take_along_axis(cost, best[..., None], axis=2))[..., 0]
+
+            d = np.hypot(self.x[:, :, None] - self.x[:, None, :], self.y[:, :, None] - self.y[:, None, :])
+            enemy = (self.side[:, None] != self.side[None, :]) & self.alive[:, None, :]
+            d = np.where(enemy, d, np.inf)
+            nearest = np.argmin(d, axis=2)
+            has_enemy = np.isfinite(np.take_along_axis(d, nearest[..., None], axis=2))[..., 0]
+            enemy_pos = np.stack([np.take_along_axis(self.x, nearest, 1), np.take_along_axis(self.y, nearest, 1)], -1)
+            targets = np.where(no_city[..., None], enemy_pos, targets)
+            targets[no_city & ~has_enemy] = np.nan
+            actions["targets"] = targets
+        if buy:
+            orders = np.full((self.num_envs, 2, 2), -1, dtype=np.int64)
+            for s in (0, 1):
+                owned = self.city_owner == s + 1
+                pick = np.argmax(np.where(owned, self.rng.random(owned.shape), -1.0), axis=1)
+                want = owned.any(axis=1) & (self.treasury[:, s] >= UNIT_COST["troop"])
+                orders[:, s, 0] = np.where(want, pick, -1)
+                orders[:, s, 1] = self.treasury[:, s] >= 600
+            actions["buy"] = orders
+        return actions
+
+    def _city_score(self):
+        return ((self.city_owner == 1).sum(axis=1) - (self.city_owner == 2).sum(axis=1)) / max(1, len(self.city_pos))
+
+    def _in_rects(self, rects, x, y):
+        if not len(rects):
+            return np.zeros(np.shape(x), dtype=bool)
+        x, y = x[..., None], y[..., None]
+        return ((rects[:, 0] <= x) & (x <= rects[:, 2]) & (rects[:, 1] <= y) & (y <= rects[:, 3])).any(axis=-1)
+
+    def _paint_territory(self, live):
+        cx = (self.x / TERRITORY_SCALE).astype(np.int64)[..., None] + self.stencil[:, 0]
+        cy = (self.y / TERRITORY_SCALE).astype(np.int64)[..., None] + self.stencil[:, 1]
+        ok = live[..., None] & (cx >= 0) & (cx < TERRITORY_W) & (cy >= 0) & (cy < TERRITORY_H)
+        env = np.broadcast_to(np.arange(self.num_envs)[:, None, None], cx.shape)
+        # Player first, then AI, as in update_territory
+        for side in (1, 2):
+            mask = ok & (self.side == side)[None, :, None]
+            self.territory[env[mask], cy[mask], cx[mask]] = side
+        terr = self.territory[:, self.city_cy, self.city_cx]
+        self.city_owner[:] = np.where((terr != 0) & ~self.done[:, None], terr, self.city_owner)
+
+    def _apply_orders(self, actions, active):
+        targets = actions.get("targets")
+        if targets is not None:
+            targets = np.asarray(targets, dtype=np.float32)
+            new = ~np.isnan(targets[..., 0]) & active[:, None]
+            self.tx[new], self.ty[new] = targets[..., 0][new], targets[..., 1][new]
+        buy = actions.get("buy")
+        if buy is None: return
+        buy = np.asarray(buy)
+        for s, side in enumerate((1, 2)):
+            city, tank = buy[:, s, 0], buy[:, s, 1].astype(bool)
+            cost = np.where(tank, UNIT_COST["tank"], UNIT_COST["troop"])
+            count = self.alive[:, self.side == side].sum(axis=1)
+            ok = active & (city >= 0) & (count < MAX_UNITS) & (self.treasury[:, s] >= cost)
+            ok[ok] &= self.city_owner[ok, city[ok]] == side
+            envs = np.nonzero(ok)[0]
+            if len(envs):
+                spawned = self._spawn(envs, side, self.city_pos[city[envs]], tank[envs])
+                self.treasury[envs[spawned], s] -= cost[envs[spawned]]
+
+    def _spawn(self, envs, side, centers, tank, attempts=50):
+        # spawn_unit for one unit in each of `envs`: first free spot 30-60px from the
+        # center, off mountains and clear of other units. Returns which envs got one.
+        block = slice(0, self.capacity) if side == 1 else slice(self.capacity, 2 * self.capacity)
+        free = ~self.alive[envs, block]
+        angle = self.rng.uniform(0, 2 * math.pi, (len(envs), attempts))
+        radius = self.rng.uniform(30, 60, (len(envs), attempts))
+        sx = np.clip(centers[:, :1] + np.cos(angle) * radius, 10, WIDTH - 10)
+        sy = np.clip(centers[:, 1:] + np.sin(angle) * radius, 10, HEIGHT - 10)
+        d = np.hypot(sx[:, :, None] - self.x[envs, None, :], sy[:, :, None] - self.y[envs, None, :])
+        clear = ~((d < SEPARATION_RADIUS) & self.alive[envs, None, :]).any(axis=2)
+        ok = clear & ~self._in_rects(self.mountains, sx, sy)
+        first = np.argmax(ok, axis=1)
+        spawned = ok.any(axis=1) & free.any(axis=1)
+        envs, first = envs[spawned], first[spawned]
+        slot = np.argmax(free[spawned], axis=1) + block.start
+        rows = np.nonzero(spawned)[0]
+        self.x[envs, slot] = self.tx[envs, slot] = sx[rows, first]
+        self.y[envs, slot] = self.ty[envs, slot] = sy[rows, first]
+        self.tank[envs, slot] = tank[spawned]
+        self.hp[envs, slot] = np.where(tank[spawned], UNIT_HP["tank"], UNIT_HP["troop"])
+        self.alive[envs, slot] = True
+        return spawned
+
+    def _move(self, live):
+        x, y = self.x, self.y
+        dx, dy = self.tx - x, self.ty - y
+        dist = np.hypot(dx, dy)
+
+        ddx = x[:, :, None] - x[:, None, :]
+        ddy = y[:, :, None] - y[:, None, :]
+        d2 = ddx * ddx + ddy * ddy
+        near = (d2 < SEPARATION_RADIUS ** 2) & (d2 > 0) & live[:, :, None] & live[:, None, :]
+        d = np.sqrt(np.where(near, d2, 1.0))
+        force = np.where(near, (SEPARATION_RADIUS - d) / (2 * d), 0.0)
+        sep_x = (ddx * force).sum(axis=2)
+        sep_y = (ddy * force).sum(axis=2)
+
+        speed = np.where(self.tank, TANK_SPEED, TROOP_SPEED) * np.where(self._in_rects(self.rivers, x, y), 0.5, 1.0)
+        moving = dist > 2
+        step = np.minimum(dist, speed) / np.where(moving, dist, 1.0)
+        nx, ny = x + dx * step + sep_x, y + dy * step + sep_y
+        blocked = self._in_rects(self.mountains, nx, ny)
+        slide_x = blocked & ~self._in_rects(self.mountains, nx, y)
+        slide_y = blocked & ~slide_x & ~self._in_rects(self.mountains, x, ny)
+        new_x = np.where(moving, np.where(~blocked | slide_x, nx, x), x + sep_x)
+        new_y = np.where(moving, np.where(~blocked | slide_y, ny, y), y + sep_y)
+        self.x[:] = np.where(live, new_x, x)
+        self.y[:] = np.where(live, new_y, y)
+
+    def _combat(self, live):
+        cap = self.capacity
+        p, a = slice(0, cap), slice(cap, 2 * cap)
+        d = np.hypot(self.x[:, p, None] - self.x[:, None, a], self.y[:, p, None] - self.y[:, None, a])
+        pairs = (d < COMBAT_RADIUS) & live[:, p, None] & live[:, None, a]
+        self.engaged[:, p] = pairs.any(axis=2)
+        self.engaged[:, a] = pairs.any(axis=1)
+        hits = pairs & (self.rng.random(pairs.shape) < HIT_CHANCE)
+        damage = np.where(self.tank, UNIT_DAMAGE["tank"], UNIT_DAMAGE["troop"]).astype(np.float32)
+        self.hp[:, p] -= (hits * damage[:, None, a]).sum(axis=2)
+        self.hp[:, a] -= (hits * damage[:, p, None]).sum(axis=1)
+        self.alive &= self.hp > 0
+        return pairs.sum(axis=(1, 2))
+
+
+# ----- Order Preview -----
+# In the multiplayer order phases the pending orders are simulated ahead on a clone
+# of the match in VecWarOfDots. PREVIEW_SAMPLES copies differ only in their combat
+# rolls. The clone advances a few ticks per frame, so input never stalls, and
+# restarts whenever an order changes. The first copy gives the projected paths and
+# engagements, and all copies together give the capture odds of every city. The side
+# not giving orders is shown holding position, so P2 can't read P1's plan.
+# Instant resolve is opt-in (I toggles it during the order phases; MP_INSTANT_RESOLVE
+# is the default). The whole turn is then computed up front the same way, under
+# VecWarOfDots rules rather than update_units, and the resolve phase plays the
+# recorded frames back through the usual events. Space skips to the end.
+PREVIEW_SAMPLES = 8
+PREVIEW_PATH_STEP = 10
+PREVIEW_BUDGET_MS = 4.0
+MP_INSTANT_RESOLVE = False
+MP_ORDER_STATES = (STATE_MP_ORDER_P1, STATE_MP_ORDER_P2)
+show_preview = True
+instant_resolve = MP_INSTANT_RESOLVE
+preview = None
+resolve_record = None
+resolve_frame = 0
+mp_envs = {}
+
+
+def reset_preview():
+    global preview, resolve_record, instant_resolve
+    preview = resolve_record = None
+    instant_resolve = MP_INSTANT_RESOLVE
+    mp_envs.clear()
+
+
+def mp_env(samples):
+    # Built once per map and army size; load_game() refills it in place
+    capacity = max(MAX_UNITS, len(player_units), len(enemy_units))
+    key = (current_map_name, samples, capacity)
+    if key not in mp_envs:
+        mp_envs[key] = VecWarOfDots(current_map_name, samples, capacity, seed=random.getrandbits(32), fields=city_fields)
+    return mp_envs[key]
+
+
+def order_signature():
+    return (state, tuple((u['id'], u['tx'], u['ty']) for u in player_units + enemy_units),
+            tuple(c['owner'] for c in cities))
+
+
+def start_preview():
+    global preview
+    env = mp_env(PREVIEW_SAMPLES)
+    env.load_game()
+    hold = slice(env.capacity, None) if state == STATE_MP_ORDER_P1 else slice(0, env.capacity)
+    env.tx[:, hold], env.ty[:, hold] = env.x[:, hold], env.y[:, hold]
+    preview = {"signature": order_signature(), "env": env, "tick": 0,
+               "paths": [np.stack([env.x[0], env.y[0]], -1)], "alive": [env.alive[0].copy()],
+               "engaged": set(), "odds": None}
+
+
+def advance_preview():
+    if not show_preview: return
+    if preview is None or preview["signature"] != order_signature():
+        start_preview()
+    if preview["odds"] is not None: return
+    env = preview["env"]
+    deadline = time.perf_counter() + PREVIEW_BUDGET_MS / 1000
+    while preview["tick"] < TURN_DURATION and time.perf_counter() < deadline:
+        env.step()
+        preview["tick"] += 1
+        for i in np.nonzero(env.engaged[0])[0].tolist():
+            preview["engaged"].add((int(env.x[0, i] // GRID_SIZE), int(env.y[0, i] // GRID_SIZE)))
+        if preview["tick"] % PREVIEW_PATH_STEP == 0:
+            preview["paths"].append(np.stack([env.x[0], env.y[0]], -1))
+            preview["alive"].append(env.alive[0].copy())
+    if preview["tick"] >= TURN_DURATION:
+        # (cities, 2): chance each side holds the city at the end of the turn
+        preview["odds"] = np.stack([(env.city_owner == side).mean(axis=0) for side in (1, 2)], -1)
+
+
+def draw_preview():
+    if not show_preview or preview is None: return
+    env = preview["env"]
+    first = 0 if state == STATE_MP_ORDER_P1 else env.capacity
+    color = DARK_GREEN if state == STATE_MP_ORDER_P1 else RED
+    paths, alive = np.stack(preview["paths"]), np.stack(preview["alive"])
+    for slot in range(first, first + env.capacity):
+        points = paths[alive[:, slot], slot].tolist()
+        if len(points) > 1:
+            pygame.draw.lines(screen, color, False, points, 1)
+        if points and not alive[-1, slot]:
+            # Projected to die: a cross where it was last seen
+            x, y = points[-1]
+            pygame.draw.line(screen, BLACK, (x - 4, y - 4), (x + 4, y + 4), 2)
+            pygame.draw.line(screen, BLACK, (x - 4, y + 4), (x + 4, y - 4), 2)
+    for gx, gy in preview["engaged"]:
+        pygame.draw.circle(screen, ORANGE, (gx * GRID_SIZE + GRID_SIZE // 2, gy * GRID_SIZE + GRID_SIZE // 2), 5, 1)
+    if preview["odds"] is None:
+        draw_text(screen, f"Preview {100 * preview['tick'] // TURN_DURATION}%", FONT_TINY, BLACK, (WIDTH - 110, 50))
+        return
+    for city, (p1, p2) in zip(cities, preview["odds"].tolist()):
+        held = p1 if city['owner'] == 'player' else p2 if city['owner'] == 'ai' else 0.0
+        if held < 1.0:
+            text = f"P1 {p1:.0%}" if p1 >= p2 else f"P2 {p2:.0%}"
+            draw_text(screen, text, FONT_TINY, DARK_GREEN if p1 >= p2 else RED, (city['pos'][0] - 18, city['pos'][1] + 16))
+
+
+def start_resolve():
+    # Records the whole turn, then STATE_MP_RESOLVE plays it back frame by frame
+    global resolve_record, resolve_frame
+    resolve_record = None
+    if not instant_resolve: return
+    env = mp_env(1)
+    env.load_game()
+    frames = []
+    while len(frames) < TURN_DURATION and not env.done[0]:
+        env.step()
+        frames.append((env.x[0].copy(), env.y[0].copy(), env.hp[0].copy(), env.alive[0].copy(),
+                       env.territory[0].copy(), env.treasury[0].copy()))
+    resolve_record = (env.slot_ids.copy(), env.capacity, frames)
+    resolve_frame = 0
+    for u in player_units + enemy_units:
+        wake_unit(u)  # positions are about to be set from the recording
+
+
+def apply_resolve_frame(frame):
+    global player_units, enemy_units
+    slot_ids, capacity, frames = resolve_record
+    x, y, hp, alive, terr, treasury = frames[frame]
+    by_id = {u['id']: u for u in player_units + enemy_units}
+    dead = []
+    for slot, uid in enumerate(slot_ids.tolist()):
+        u = by_id.get(uid)
+        if u is None: continue
+        u['x'], u['y'] = float(x[slot]), float(y[slot])
+        lost = u['hp'] - float(hp[slot])
+        if lost > 0:
+            u['hp'] = float(hp[slot])
+            spawn_damage_number(u, int(round(lost)))
+        if not alive[slot]:
+            dead.append((u, 'player' if slot < capacity else 'ai'))
+    for gy, gx in np.argwhere(terr != territory).tolist():
+        paint_territory(gx, gy, TERRITORY_OWNERS[terr[gy, gx]])
+    # Nobody buys during a turn, so the treasury change is all income
+    earn_income(treasury[0] - treasury_p1, treasury[1] - treasury_p2)
+    if dead:
+        player_units = [u for u in player_units if u['hp'] > 0]
+        enemy_units = [u for u in enemy_units if u['hp'] > 0]
+        for u, owner in dead:
+            emit(EVT_UNIT_DIED, unit=u, owner=owner)
+
+
+def replay_resolve_tick(skip=False):
+    global resolve_frame, turn_timer
+    floating_texts.update()
+    frames = resolve_record[2]
+    resolve_frame = len(frames) - 1 if skip else resolve_frame
+    if resolve_frame < len(frames):
+        apply_resolve_frame(resolve_frame)
+        resolve_frame += 1
+    turn_timer = TURN_DURATION - resolve_frame
+    if resolve_frame >= len(frames) and state == STATE_MP_RESOLVE:
+        end_resolve_turn()
+
+
+# ----- Idle Menus -----
+# Menu screens are static, so instead of redrawing at FPS they block on input and
+# only redraw and present the frame when the state changed or the window needs it.
+# Every redraw replaces the whole screen, so the frame is presented in full.
+# MENU_WAIT_MS caps how long a wait lasts, for menu animations.
+IDLE_MENUS = True
+MENU_WAIT_MS = 500
+MENU_REDRAW_EVENTS = {getattr(pygame, name) for name in
+                      ("VIDEOEXPOSE", "VIDEORESIZE", "WINDOWEXPOSED", "WINDOWSIZECHANGED", "WINDOWRESTORED")
+                      if hasattr(pygame, name)}
+menu_drawn_state = None
+menu_present_pending = False
+
+
+def menu_needs_redraw():
+    return not IDLE_MENUS or menu_drawn_state != state
+
+
+def present_menu():
+    global menu_drawn_state, menu_present_pending
+    menu_drawn_state = state
+    menu_present_pending = True
+
+
+def menu_events():
+    global menu_drawn_state, menu_present_pending
+    if menu_present_pending:
+        present()
+        menu_present_pending = False
+    if not IDLE_MENUS:
+        return pygame.event.get()
+    events = [pygame.event.wait(MENU_WAIT_MS)] + pygame.event.get()
+    if any(e.type in MENU_REDRAW_EVENTS or e.type == ASSETS_READY for e in events):
+        menu_drawn_state = None
+    return [e for e in events if e.type not in (pygame.NOEVENT, ASSETS_READY)]
+
+
 # ----- Main Loop -----
 def main():
-    global state
+    global state, menu_drawn_state, last_frame_ms
     running = True
     last_time = pygame.time.get_ticks()
 
@@ -940,14 +2891,16 @@ def main():
         current_time = pygame.time.get_ticks()
         dt = (current_time - last_time) / 1000.0
         last_time = current_time
+        apply_loaded_fonts()
 
         if state == STATE_HOME:
-            btns = draw_home()
-            pygame.display.flip()
-            for e in pygame.event.get():
+            if menu_needs_redraw():
+                btns = draw_home()
+                present_menu()
+            for e in menu_events():
                 if e.type == pygame.QUIT: running = False
                 if e.type == pygame.MOUSEBUTTONDOWN:
-                    mp = pygame.mouse.get_pos()
+                    mp = logical_mouse_pos()
                     if btns['single'].collidepoint(mp):
                         init_game("", "single")
                         state = STATE_MAP_SELECT
@@ -957,12 +2910,13 @@ def main():
                     elif btns['tutorial'].collidepoint(mp):
                         state = STATE_TUTORIAL
         elif state == STATE_MAP_SELECT:
-            btns = draw_map_select()
-            pygame.display.flip()
-            for e in pygame.event.get():
+            if menu_needs_redraw():
+                btns = draw_map_select()
+                present_menu()
+            for e in menu_events():
                 if e.type == pygame.QUIT: running = False
                 if e.type == pygame.MOUSEBUTTONDOWN:
-                    mp = pygame.mouse.get_pos()
+                    mp = logical_mouse_pos()
                     if btns['map1'].collidepoint(mp):
                         init_game("classic_bridge", game_mode)
                     elif btns['map2'].collidepoint(mp):
@@ -974,28 +2928,40 @@ def main():
                     elif btns['back'].collidepoint(mp):
                         state = STATE_HOME
         elif state == STATE_TUTORIAL:
-            draw_tutorial()
-            pygame.display.flip()
-            for e in pygame.event.get():
+            if menu_needs_redraw():
+                draw_tutorial()
+                present_menu()
+            for e in menu_events():
                 if e.type == pygame.QUIT: running = False
                 if e.type == pygame.KEYDOWN and e.key == pygame.K_b: state = STATE_HOME
         elif state == STATE_END:
-            res_btn = draw_end_screen()
-            pygame.display.flip()
-            for e in pygame.event.get():
+            if menu_needs_redraw():
+                res_btn = draw_end_screen()
+                present_menu()
+            for e in menu_events():
                 if e.type == pygame.QUIT: running = False
-                if e.type == pygame.MOUSEBUTTONDOWN and res_btn.collidepoint(pygame.mouse.get_pos()): state = STATE_HOME
+                if e.type == pygame.MOUSEBUTTONDOWN and res_btn.collidepoint(logical_mouse_pos()): state = STATE_HOME
         else:
             for event in pygame.event.get():
                 if event.type == pygame.QUIT: running = False
                 game_events(event)
-            update_treasury(dt)
-            update_territory()
-            check_city_capture()
-            update_units(dt)
+            frame_start = time.perf_counter()
+            simulate_tick(dt)
+            if state in MP_ORDER_STATES:
+                advance_preview()
             draw_game()
-            pygame.display.flip()
-        clock.tick(FPS)
+            audio.flush()
+            present()
+            last_frame_ms = 1000 * (time.perf_counter() - frame_start)
+            memory_tick()
+            menu_drawn_state = None
+
+        if IDLE_MENUS and menu_drawn_state is not None:
+            # Time spent waiting in a menu is not game time
+            last_time = pygame.time.get_ticks()
+        else:
+            clock.tick(FPS)
+    stop_telemetry()
     pygame.quit()
     sys.exit()
 
@@ -0,0 +1,65 @@
+# Soak test: plays headless matches back-to-back, cycling the maps, and fails if
+# retained memory keeps growing. After every match (and a gc pass) it records the
+# size traced by tracemalloc and the total of main.memory_report(); the first
+# --warmup matches fill caches and are left out. A leak shows up as a steady slope:
+# the test fails when the fitted growth over the remaining matches is above
+# --tolerance-kb, and prints where the traced memory grew.
+#
+#   python soak_test.py [--matches 20] [--ticks 1800] [--warmup 3] [--tolerance-kb 256]
+import os
+import sys
+import argparse
+import gc
+import tracemalloc
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import numpy as np
+import main
+
+MAPS = ["classic_bridge", "twin_islands", "mountain_pass", "crossroads"]
+
+
+def growth_kb(samples):
+    # Fitted growth across the samples, so one noisy match can't fail the run alone
+    slope = np.polyfit(np.arange(len(samples)), samples, 1)[0]
+    return slope * (len(samples) - 1) / 1024
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Back-to-back headless matches, failing on retained memory growth")
+    parser.add_argument("--matches", type=int, default=20)
+    parser.add_argument("--ticks", type=int, default=1800)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--tolerance-kb", type=float, default=256.0)
+    args = parser.parse_args()
+
+    main.TELEMETRY_ENABLED = False
+    tracemalloc.start()
+    traced, reported, first = [], [], None
+    print(f"{'match':<7}{'map':<16}{'ticks':>7}{'traced':>12}{'reported':>12}{'particles':>11}")
+    for match in range(args.matches):
+        map_name = MAPS[match % len(MAPS)]
+        ticks = main.run_headless_match(map_name, args.ticks)
+        gc.collect()
+        report = main.memory_report()
+        traced.append(tracemalloc.get_traced_memory()[0])
+        reported.append(sum(b for _, b in report.values()))
+        if match == args.warmup:
+            first = tracemalloc.take_snapshot()
+        print(f"{match + 1:<7}{map_name:<16}{ticks:>7}{traced[-1] / 1024:>9.0f} KB{reported[-1] / 1024:>9.0f} KB"
+              f"{report['particles'][0]:>11}")
+
+    kept = slice(args.warmup, None)
+    grown = {"traced": growth_kb(traced[kept]), "reported": growth_kb(reported[kept])}
+    print("growth after warmup: " + ", ".join(f"{k} {v:+.1f} KB" for k, v in grown.items()))
+    if max(grown.values()) > args.tolerance_kb:
+        print(f"retained memory keeps growing (tolerance {args.tolerance_kb:.0f} KB); top growth since match {args.warmup + 1}:")
+        for stat in tracemalloc.take_snapshot().compare_to(first, "lineno")[:10]:
+            print(f"  {stat}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,159 @@
+# Offline trainer for the AI policy network in main.py.
+#
+# Plays headless self-play matches on CPU with both sides driven by plan_ai_orders.
+# The first generation follows the nearest-city heuristic with random exploration;
+# later ones follow the current weights. Every squad decision is scored by how the
+# deciding side's position changed over the next few thinks, and the network is fit
+# with advantage-weighted cross-entropy over the candidate targets (plain NumPy).
+# Writes policy_weights.npz next to main.py.
+#
+#   python train_policy.py --generations 5 --matches 8
+import os
+import argparse
+import random
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import numpy as np
+import main
+
+MAPS = ["classic_bridge", "twin_islands", "mountain_pass", "crossroads"]
+MAX_CANDIDATES = 8  # largest map has 6 cities, plus enemy unit and hold
+HORIZON = 5  # thinks ahead used to score a decision
+HIDDEN = 16
+BETA = 1.0
+
+
+def side_score(owner):
+    own_units, enemy = (main.player_units, main.enemy_units) if owner == 'player' else (main.enemy_units, main.player_units)
+    other = 'ai' if owner == 'player' else 'player'
+    own_cities = sum(1 for c in main.cities if c['owner'] == owner)
+    enemy_cities = sum(1 for c in main.cities if c['owner'] == other)
+    return (own_cities - enemy_cities) + 0.1 * (len(own_units) - len(enemy))
+
+
+def pad(feats, valid):
+    n, k, f = feats.shape
+    out_f = np.zeros((n, MAX_CANDIDATES, f), np.float32)
+    out_v = np.zeros((n, MAX_CANDIDATES), bool)
+    out_f[:, :k], out_v[:, :k] = feats, valid
+    return out_f, out_v
+
+
+def play(map_name, explore, max_ticks):
+    # Returns padded features, validity, chosen candidate and reward for every squad decision
+    main.ai_decision_log = log = []
+    main.AI_EXPLORE = explore
+    decisions = []
+    scores = {'player': [], 'ai': []}
+
+    def on_tick(tick):
+        while log:
+            owner, feats, valid, choice = log.pop(0)
+            decisions.append((owner, feats, valid, choice, len(scores[owner])))
+            scores[owner].append(side_score(owner))
+
+    main.run_headless_match(map_name, max_ticks, explore, on_tick)
+    on_tick(None)
+    main.ai_decision_log = None
+
+    out = ([], [], [], [])
+    for owner, feats, valid, choice, i in decisions:
+        trace = scores[owner] + [side_score(owner)]
+        j = min(i + HORIZON, len(trace) - 1)
+        f, v = pad(feats, valid)
+        for lst, item in zip(out, (f, v, choice, np.full(len(choice), trace[j] - trace[i], np.float32))):
+            lst.append(item)
+    return [np.concatenate(lst) for lst in out]
+
+
+def forward(params, x):
+    h_pre = x @ params['w1'] + params['b1']
+    h = np.maximum(h_pre, 0)
+    return h_pre, h, (h @ params['w2'] + params['b2'])[..., 0]
+
+
+def fit(feats, valid, choice, reward, epochs, lr=3e-3, batch=256, seed=0):
+    rng = np.random.default_rng(seed)
+    flat = feats[valid]
+    mean, std = flat.mean(axis=0), flat.std(axis=0) + 1e-3
+    xn = (feats - mean) / std
+    adv = (reward - reward.mean()) / (reward.std() + 1e-6)
+    weight = np.minimum(np.exp(adv / BETA), 20.0).astype(np.float32)
+    f = feats.shape[2]
+    params = {
+        'w1': rng.normal(0, 1 / np.sqrt(f), (f, HIDDEN)).astype(np.float32),
+        'b1': np.zeros(HIDDEN, np.float32),
+        'w2': rng.normal(0, 1 / np.sqrt(HIDDEN), (HIDDEN, 1)).astype(np.float32),
+        'b2': np.zeros(1, np.float32),
+    }
+    m = {k: np.zeros_like(p) for k, p in params.items()}
+    v = {k: np.zeros_like(p) for k, p in params.items()}
+    step = 0
+    for epoch in range(epochs):
+        order = rng.permutation(len(xn))
+        total, hits = 0.0, 0
+        for start in range(0, len(order), batch):
+            idx = order[start:start + batch]
+            xb, vb, cb, wb = xn[idx], valid[idx], choice[idx], weight[idx]
+            rows = np.arange(len(idx))
+            h_pre, h, logits = forward(params, xb)
+            logits = np.where(vb, logits, -1e9)
+            logits -= logits.max(axis=1, keepdims=True)
+            prob = np.exp(logits)
+            prob /= prob.sum(axis=1, keepdims=True)
+            total += float(-(wb * np.log(prob[rows, cb] + 1e-9)).sum())
+            hits += int((prob.argmax(axis=1) == cb).sum())
+
+            g_logit = prob.copy()
+            g_logit[rows, cb] -= 1.0
+            g_logit *= (wb / len(idx))[:, None]
+            g_logit[~vb] = 0.0
+            g_out = g_logit[..., None]
+            g_h = (g_out @ params['w2'].T) * (h_pre > 0)
+            grads = {'w2': np.einsum('bkh,bko->ho', h, g_out), 'b2': g_out.sum(axis=(0, 1)),
+                     'w1': np.einsum('bkf,bkh->fh', xb, g_h), 'b1': g_h.sum(axis=(0, 1))}
+            step += 1
+            for k in params:
+                m[k] = 0.9 * m[k] + 0.1 * grads[k]
+                v[k] = 0.999 * v[k] + 0.001 * grads[k] ** 2
+                params[k] -= lr * (m[k] / (1 - 0.9 ** step)) / (np.sqrt(v[k] / (1 - 0.999 ** step)) + 1e-8)
+        print(f"  epoch {epoch + 1}/{epochs}  loss {total / len(xn):.4f}  agreement {hits / len(xn):.2f}")
+    params['mean'], params['std'] = mean.astype(np.float32), std.astype(np.float32)
+    return params
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Train the War of Dots AI policy from headless self-play")
+    parser.add_argument("--generations", type=int, default=3)
+    parser.add_argument("--matches", type=int, default=4, help="matches per generation")
+    parser.add_argument("--ticks", type=int, default=2400, help="max ticks per match")
+    parser.add_argument("--epochs", type=int, default=6)
+    parser.add_argument("--explore", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=main.POLICY_PATH)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    main.TELEMETRY_ENABLED = False
+    # Self-play starts from the heuristic unless weights already exist at --out
+    main.POLICY_PATH = args.out
+    main.ai_policy = None
+    data = []
+    for gen in range(args.generations):
+        t0 = time.perf_counter()
+        for i in range(args.matches):
+            data.append(play(MAPS[(gen * args.matches + i) % len(MAPS)], args.explore, args.ticks))
+        feats, valid, choice, reward = [np.concatenate(d) for d in zip(*data)]
+        print(f"generation {gen}: {len(feats)} decisions, self-play {time.perf_counter() - t0:.1f}s")
+        params = fit(feats, valid, choice, reward, args.epochs, seed=args.seed + gen)
+        np.savez(args.out, **params)
+        main.ai_policy = None  # reload the new weights for the next generation
+    print(f"saved {args.out}")
+
+
+if __name__ == "__main__":
+    main_cli()